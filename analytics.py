@@ -1,11 +1,28 @@
 import os
+import atexit
+import threading
 import psycopg2
 import json
 from datetime import datetime
+from psycopg2.extras import execute_values
+
+from db_pool import get_pool
+from event_writer import EventWriter
+from profile_cache import PROFILE_DEFAULTS, ProfileCache
 
 # Get DB URL from environment (set this in Render)
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Events are written by a background batch writer unless ANALYTICS_ASYNC=0
+ANALYTICS_ASYNC = os.getenv("ANALYTICS_ASYNC", "1") != "0"
+
+# Process-local profile cache (see profile_cache.py for TTL/size settings). Only used
+# when conversation state is per process too: with a shared STATE_STORE (sqlite or
+# postgres) a user's next message may land on another worker, whose cached copy
+# would be stale, so profiles are always read from Postgres.
+PROFILE_CACHE_ENABLED = os.getenv("STATE_STORE", "memory") == "memory"
+profile_cache = ProfileCache()
+
 
 def get_connection():
     """Establish a connection to the PostgreSQL database."""
@@ -14,9 +31,18 @@ def get_connection():
     return psycopg2.connect(DATABASE_URL, sslmode="require")
 
 
+def pooled_connection():
+    """Borrow a connection from the process-wide pool (use as a `with` block)."""
+    return get_pool(get_connection).connection()
+
+
 def init_db():
     """Create the events and user_profiles tables if they don't exist."""
-    conn = get_connection()
+    with pooled_connection() as conn:
+        _create_tables(conn)
+
+
+def _create_tables(conn):
     cur = conn.cursor()
 
     # Table for logging events
@@ -50,26 +76,59 @@ def init_db():
 
     conn.commit()
     cur.close()
-    conn.close()
 
 
 def log_event(user_id, event_type, payload_dict):
-    """Insert a usage event into the database."""
+    """Queue a usage event for the background writer (never blocks on the database)."""
     try:
-        conn = get_connection()
+        row = (user_id, event_type, datetime.utcnow(), json.dumps(payload_dict))
+    except Exception as e:
+        print(f"[Analytics Error] Failed to log event: {e}")
+        return
+    _enqueue_event(row)
+
+
+def _enqueue_event(row):
+    try:
+        if ANALYTICS_ASYNC:
+            get_event_writer().enqueue(row)
+        else:
+            write_events([row])
+    except Exception as e:
+        print(f"[Analytics Error] Failed to log event: {e}")
+
+
+def write_events(rows):
+    """Insert a batch of (user_id, event_type, timestamp, payload_json) rows in one statement."""
+    with pooled_connection() as conn:
         cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO usage_events (user_id, event_type, timestamp, payload)
-            VALUES (%s, %s, %s, %s)
-        """,
-            (user_id, event_type, datetime.utcnow(), json.dumps(payload_dict)),
+        execute_values(
+            cur,
+            "INSERT INTO usage_events (user_id, event_type, timestamp, payload) VALUES %s",
+            rows,
         )
         conn.commit()
         cur.close()
-        conn.close()
-    except Exception as e:
-        print(f"[Analytics Error] Failed to log event: {e}")
+
+
+_event_writer = None
+_event_writer_lock = threading.Lock()
+
+
+def get_event_writer():
+    """Return the process-wide event writer, creating it on first use."""
+    global _event_writer
+    if _event_writer is None:
+        with _event_writer_lock:
+            if _event_writer is None:
+                _event_writer = EventWriter(write_events)
+                atexit.register(_event_writer.stop)
+    return _event_writer
+
+
+def event_writer_stats():
+    """Counters for the background writer: enqueued, dropped, flushed, failed, batches, queued."""
+    return get_event_writer().stats()
 
 
 def create_or_update_user(
@@ -81,73 +140,162 @@ def create_or_update_user(
     streak=None,
     waiting_for_answer=None,
 ):
-    """Insert or update a user profile in Postgres."""
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        fields = []
-        values = []
-        if name is not None:
-            fields.append("name = %s")
-            values.append(name)
-        if chosen_track is not None:
-            fields.append("chosen_track = %s")
-            values.append(chosen_track)
-        if current_day is not None:
-            fields.append("current_day = %s")
-            values.append(current_day)
-        if points is not None:
-            fields.append("points = %s")
-            values.append(points)
-        if streak is not None:
-            fields.append("streak = %s")
-            values.append(streak)
-        if waiting_for_answer is not None:
-            fields.append("waiting_for_answer = %s")
-            values.append(waiting_for_answer)
-
-        if fields:
-            sql = f"""
-                INSERT INTO user_profiles (phone_number) VALUES (%s)
-                ON CONFLICT (phone_number) DO UPDATE SET {', '.join(fields)}, last_updated = CURRENT_TIMESTAMP
-            """
-            cur.execute(sql, [phone] + values)
+    """Insert or update a user profile in Postgres (and write through to the profile cache)."""
+    changes = {
+        key: value
+        for key, value in (
+            ("name", name),
+            ("chosen_track", chosen_track),
+            ("current_day", current_day),
+            ("points", points),
+            ("streak", streak),
+            ("waiting_for_answer", waiting_for_answer),
+        )
+        if value is not None
+    }
+    if not changes:
+        return
 
-        conn.commit()
-        cur.close()
-        conn.close()
+    try:
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            _upsert_profile(cur, phone, changes)
+            conn.commit()
+            cur.close()
     except Exception as e:
+        profile_cache.invalidate(phone)
         print(f"[Analytics Error] Failed to update user profile: {e}")
+    else:
+        profile_cache.apply_update(phone, changes)
+
+
+def _upsert_profile(cur, phone, changes):
+    """Insert the row with `changes`, or update only those columns if it already exists."""
+    columns = list(changes)  # keys come from a fixed whitelist, never user input
+    sql = f"""
+        INSERT INTO user_profiles (phone_number, {', '.join(columns)})
+        VALUES (%s{', %s' * len(columns)})
+        ON CONFLICT (phone_number) DO UPDATE SET
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in columns)}, last_updated = CURRENT_TIMESTAMP
+    """
+    cur.execute(sql, [phone] + [changes[c] for c in columns])
 
 
 def get_user_profile(phone):
-    """Fetch a user profile by phone number."""
+    """Fetch a user profile by phone number (served from the profile cache when possible)."""
+    if PROFILE_CACHE_ENABLED:
+        hit, profile = profile_cache.get(phone)
+        if hit:
+            return profile
+
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT phone_number, name, chosen_track, current_day, points, streak, waiting_for_answer
-            FROM user_profiles WHERE phone_number = %s
-        """,
-            (phone,),
-        )
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
-
-        if row:
-            return {
-                "phone_number": row[0],
-                "name": row[1],
-                "chosen_track": row[2],
-                "current_day": row[3],
-                "points": row[4],
-                "streak": row[5],
-                "waiting_for_answer": bool(row[6]),
-            }
-        return None
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT phone_number, name, chosen_track, current_day, points, streak, waiting_for_answer
+                FROM user_profiles WHERE phone_number = %s
+            """,
+                (phone,),
+            )
+            row = cur.fetchone()
+            cur.close()
     except Exception as e:
         print(f"[Analytics Error] Failed to fetch user profile: {e}")
         return None
+
+    profile = None
+    if row:
+        profile = {
+            "phone_number": row[0],
+            "name": row[1],
+            "chosen_track": row[2],
+            "current_day": row[3],
+            "points": row[4],
+            "streak": row[5],
+            "waiting_for_answer": bool(row[6]),
+        }
+    if PROFILE_CACHE_ENABLED:
+        profile_cache.put(phone, profile)
+    return profile
+
+
+def invalidate_user_profile(phone):
+    """Drop a cached profile, e.g. after editing user_profiles outside this process."""
+    profile_cache.invalidate(phone)
+
+
+def profile_cache_stats():
+    """Hit/miss counters and current size of the profile cache."""
+    return profile_cache.stats()
+
+
+# -------- Request-scoped unit of work -------- #
+_UNLOADED = object()
+
+
+class UserUnitOfWork:
+    """
+    Per-request view of one user's profile. The profile is loaded at most once,
+    field changes and events are collected, and `commit()` writes them together:
+    one upsert plus all events in a single transaction. Requests that change no
+    profile fields hand their events to the background writer instead.
+    """
+
+    def __init__(self, phone):
+        self.phone = phone
+        self._loaded = _UNLOADED
+        self._changes = {}
+        self._events = []
+
+    @property
+    def profile(self):
+        """The stored profile with this request's pending changes applied (None if unknown)."""
+        if self._loaded is _UNLOADED:
+            self._loaded = get_user_profile(self.phone) if self.phone else None
+        if not self._changes:
+            return self._loaded
+        base = self._loaded or {"phone_number": self.phone, **PROFILE_DEFAULTS}
+        return {**base, **self._changes}
+
+    def update(self, **fields):
+        """Stage profile field changes (same keywords as create_or_update_user)."""
+        unknown = set(fields) - set(PROFILE_DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown profile fields: {', '.join(sorted(unknown))}")
+        self._changes.update({k: v for k, v in fields.items() if v is not None})
+
+    def log_event(self, event_type, payload_dict):
+        """Stage a usage event; it is written when the unit commits."""
+        self._events.append((self.phone, event_type, datetime.utcnow(), json.dumps(payload_dict)))
+
+    def commit(self):
+        """Write staged changes and events. Never raises; errors are logged like other analytics calls."""
+        changes, self._changes = self._changes, {}
+        events, self._events = self._events, []
+        if changes:
+            save_user_changes(self.phone, changes, events)
+        else:
+            for row in events:
+                _enqueue_event(row)
+
+
+def save_user_changes(phone, changes, events):
+    """Upsert profile `changes` and insert `events` rows in one transaction."""
+    try:
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            _upsert_profile(cur, phone, changes)
+            if events:
+                execute_values(
+                    cur,
+                    "INSERT INTO usage_events (user_id, event_type, timestamp, payload) VALUES %s",
+                    events,
+                )
+            conn.commit()
+            cur.close()
+    except Exception as e:
+        profile_cache.invalidate(phone)
+        print(f"[Analytics Error] Failed to save user changes: {e}")
+    else:
+        profile_cache.apply_update(phone, changes)
@@ -0,0 +1,122 @@
+# asgi.py
+# Async (ASGI) serving mode for /bot and /health, sharing the stage machine in main.py.
+# Blocking DB work runs on threads and the chat completion is awaited with AsyncOpenAI,
+# so one worker can hold many in-flight conversations instead of one per thread.
+#
+#   uvicorn asgi:app --port 5000
+#   gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+
+import asyncio
+from urllib.parse import parse_qsl
+
+from openai import AsyncOpenAI
+from twilio.twiml.messaging_response import Message, MessagingResponse
+
+import llm
+import main
+from analytics import UserUnitOfWork
+
+# Async OpenAI client for the conversation (guardrail.py has its own)
+async_client = AsyncOpenAI()
+
+_TEXT_HEADERS = [
+    (b"content-type", b"text/html; charset=utf-8"),
+    (b"access-control-allow-origin", b"*"),  # same as flask_cors defaults in main.py
+]
+
+
+async def complete_gpt_reply_async(turn):
+    """Awaitable twin of main.complete_gpt_reply."""
+    messages = list(turn.messages) or main.build_gpt_messages(turn.prompt)
+    return await llm.complete_async(async_client, turn.step, messages)
+
+
+async def bot(values):
+    """Async twin of main.bot(): returns the TwiML reply as a string."""
+    from_number = values.get("From")
+    incoming_msg = values.get("Body", "").strip()
+
+    response = MessagingResponse()
+    msg = Message()
+
+    uow = UserUnitOfWork(from_number)
+    state, version, before = await asyncio.to_thread(main.load_conversation, from_number)
+    try:
+        turn = await asyncio.to_thread(
+            main.handle_message, from_number, incoming_msg, msg, uow, state
+        )
+        if turn is not None:
+            if main.DEFERRED_REPLIES or main.cached_gpt_reply(turn) is not None:
+                main.run_gpt_turn(from_number, turn, msg, uow, state)  # enqueues or uses the cache
+            else:
+                try:
+                    reply = await complete_gpt_reply_async(turn)
+                except Exception as e:
+                    print("[ERROR in GPT fallback]", str(e))
+                    msg.body(main.GPT_ERROR_REPLY)
+                else:
+                    main.remember_gpt_reply(turn, reply)
+                    main.apply_gpt_reply(turn, reply, msg, uow, state)
+    finally:
+        await asyncio.to_thread(_finish_request, from_number, uow, state, version, before)
+
+    if msg.verbs:
+        response.append(msg)
+    return str(response)
+
+
+def _finish_request(from_number, uow, state, version, before):
+    uow.commit()
+    main.save_conversation(from_number, state, version, before)
+
+
+# -------- ASGI plumbing -------- #
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == "/health":
+        if method != "GET":
+            await _respond(send, 405, b"Method Not Allowed")
+            return
+        await _respond(send, 200, b"ok")
+    elif path == "/bot":
+        if method != "POST":
+            await _respond(send, 405, b"Method Not Allowed")
+            return
+        body = await _read_body(receive)
+        # Like Flask's request.values: query string first, then form fields
+        # (invalid UTF-8 is replaced, as Werkzeug does, rather than failing the request)
+        values = dict(parse_qsl(body.decode("utf-8", errors="replace"), keep_blank_values=True))
+        values.update(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        await _respond(send, 200, (await bot(values)).encode("utf-8"))
+    else:
+        await _respond(send, 404, b"Not Found")
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status, body):
+    await send({"type": "http.response.start", "status": status, "headers": _TEXT_HEADERS})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,185 @@
+# context_window.py
+# Token-budgeted conversation context: a sliding window of recent turns plus a
+# compact extractive summary of older turns. Turns are added one at a time and
+# folded into the summary as they leave the window, so the summary is updated
+# incrementally and never rebuilt from the full history.
+
+from collections import deque
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+SUMMARY_SNIPPET_CHARS = 120  # longest excerpt kept per summarized turn
+SYNC_MEMORY = 64  # recent turns remembered to line up history snapshots
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English chat text)."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+class RollingSummary:
+    """
+    Extractive summary of turns that fell out of the window: a count of folded
+    turns plus short excerpts of the most salient ones. When the excerpts exceed
+    `max_tokens`, the least salient (oldest first) are dropped.
+    """
+
+    def __init__(self, max_tokens: int, salience: Optional[Callable[[str], int]] = None):
+        self.max_tokens = max_tokens
+        self._salience = salience or (lambda turn: 0)
+        self.folded = 0
+        self._notes: List[Tuple[int, int, str]] = []  # (salience, order, excerpt)
+        self._tokens = 0
+
+    def fold(self, turn: str) -> None:
+        self.folded += 1
+        score = self._salience(turn)
+        if score <= 0:
+            return
+        excerpt = (
+            turn if len(turn) <= SUMMARY_SNIPPET_CHARS else turn[: SUMMARY_SNIPPET_CHARS - 1] + "…"
+        )
+        self._notes.append((score, self.folded, excerpt))
+        self._tokens += estimate_tokens(excerpt)
+        while self._tokens > self.max_tokens and self._notes:
+            weakest = min(self._notes)  # lowest salience, then oldest
+            self._notes.remove(weakest)
+            self._tokens -= estimate_tokens(weakest[2])
+
+    def render(self) -> str:
+        if not self.folded:
+            return ""
+        if not self._notes:
+            return f"Earlier: {self.folded} turns, nothing notable."
+        notes = sorted(self._notes, key=lambda note: note[1])
+        lines = [f"Earlier ({self.folded} turns), notable:"]
+        lines.extend(f"- {excerpt}" for _, _, excerpt in notes)
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {"folded": self.folded, "notes": [list(note) for note in self._notes]}
+
+    def load(self, data: dict) -> None:
+        self.folded = data.get("folded", 0)
+        self._notes = [tuple(note) for note in data.get("notes", [])]
+        self._tokens = sum(estimate_tokens(note[2]) for note in self._notes)
+
+
+class ContextWindow:
+    """
+    Recent turns kept under `max_tokens` and `max_turns` (the newest turn is
+    always kept); older turns are folded into a RollingSummary of at most
+    `summary_tokens`.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        summary_tokens: int,
+        salience: Optional[Callable[[str], int]] = None,
+        max_turns: Optional[int] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.max_turns = max_turns
+        self.summary = RollingSummary(summary_tokens, salience)
+        self._turns = deque()  # (turn, tokens)
+        self._tokens = 0
+        self._seen = deque(maxlen=SYNC_MEMORY)  # raw recent turns, for sync()
+        self._snapshots = deque(maxlen=SYNC_MEMORY)  # hashes of synced histories
+        self._synced_len = 0  # length of the last synced history
+
+    def add(self, turn: str) -> None:
+        tokens = estimate_tokens(turn)
+        self._seen.append(turn)
+        self._turns.append((turn, tokens))
+        self._tokens += tokens
+        while len(self._turns) > 1 and (
+            self._tokens > self.max_tokens
+            or (self.max_turns is not None and len(self._turns) > self.max_turns)
+        ):
+            old, old_tokens = self._turns.popleft()
+            self._tokens -= old_tokens
+            self.summary.fold(old)
+
+    def extend(self, turns: Iterable[str]) -> None:
+        for turn in turns:
+            self.add(turn)
+
+    def turns(self) -> List[str]:
+        return [turn for turn, _ in self._turns]
+
+    @property
+    def count(self) -> int:
+        """Turns added over the window's life, folded ones included (the last turn's sequence number)."""
+        return self.summary.folded + len(self._turns)
+
+    def reset(self) -> None:
+        """Forget every turn and the summary (the conversation started over)."""
+        self.summary = RollingSummary(self.summary.max_tokens, self.summary._salience)
+        self._turns.clear()
+        self._tokens = 0
+        self._seen.clear()
+        self._snapshots.clear()
+        self._synced_len = 0
+
+    def sync(self, history: Sequence[str]) -> int:
+        """
+        Add the turns of a history snapshot that have not been seen yet, where
+        `history` is the latest view of a bounded list that only grows at the
+        end (older entries may have dropped off the front). A snapshot synced
+        before (arriving late) adds nothing. One that shrank or doesn't line up
+        with the known turns belongs to a new conversation: the window and
+        summary are reset first. Returns the number of turns added.
+        """
+        history = list(history)
+        snapshot = hash(tuple(history))
+        if self._snapshots and snapshot == self._snapshots[-1]:
+            return 0
+        new = None
+        if len(history) >= self._synced_len:
+            known = list(self._seen)
+            m = len(known)
+            # Find where the turns we already know end in `history`; the rest is new.
+            # The list only grows or slides, so the known part is at most as long as
+            # the last snapshot and at least one turn is new.
+            for end in range(min(self._synced_len, len(history) - 1), 0, -1):
+                k = min(m, end)
+                if k and history[end - k : end] == known[m - k :]:
+                    new = history[end:]
+                    break
+        if new is None:
+            if snapshot in self._snapshots:
+                return 0  # an older snapshot arriving late (priority reordering)
+            self.reset()
+            new = history
+        self._snapshots.append(snapshot)
+        self._synced_len = len(history)
+        self.extend(new)
+        return len(new)
+
+    def to_dict(self) -> dict:
+        """JSON-friendly snapshot (e.g. for the conversation state record)."""
+        return {"turns": self.turns(), "summary": self.summary.to_dict()}
+
+    def load(self, data: Optional[dict]) -> "ContextWindow":
+        """Restore a to_dict() snapshot into this (empty) window."""
+        data = data or {}
+        self.summary.load(data.get("summary", {}))
+        for turn in data.get("turns", []):
+            tokens = estimate_tokens(turn)
+            self._turns.append((turn, tokens))
+            self._tokens += tokens
+            self._seen.append(turn)
+        return self
+
+    def render(self) -> Tuple[str, dict]:
+        """Context text plus its token breakdown."""
+        summary = self.summary.render()
+        recent = "\n".join(self.turns())
+        text = f"{summary}\n{recent}" if summary and recent else summary or recent
+        counts = {
+            "window_tokens": self._tokens,
+            "window_turns": len(self._turns),
+            "summary_tokens": estimate_tokens(summary),
+            "summarized_turns": self.summary.folded,
+        }
+        return text, counts
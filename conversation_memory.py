@@ -0,0 +1,132 @@
+# conversation_memory.py
+# Multi-turn context for the chat model. The last MEMORY_TURNS user/assistant
+# turns are kept under MEMORY_TOKENS; older turns are folded into a rolling
+# extractive summary (context_window.RollingSummary) as they drop out, so the
+# summary is updated one turn at a time. The memory lives on the conversation
+# state record, and every prompt is measured and capped at PROMPT_TOKEN_CAP so
+# cost and latency stay flat however long the conversation runs.
+
+import os
+import threading
+from typing import List, Optional
+
+from context_window import ContextWindow, estimate_tokens
+from prescreen import score_text
+
+# -------- Config (env) -------- #
+MEMORY_TURNS = int(os.getenv("MEMORY_TURNS", "8"))  # recent turns sent verbatim
+MEMORY_TOKENS = int(os.getenv("MEMORY_TOKENS", "600"))  # budget for those turns
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "150"))
+PROMPT_TOKEN_CAP = int(
+    os.getenv("PROMPT_TOKEN_CAP", "2000")
+)  # whole request, system prompt included
+
+USER, ASSISTANT = "User: ", "Ally: "
+_MESSAGE_OVERHEAD = 4  # tokens of chat formatting per message
+
+
+def _salience(turn: str) -> int:
+    """Keep what the user told us (risk cues first); Ally's own replies are only counted."""
+    if not turn.startswith(USER):
+        return 0
+    return 1 + score_text(turn)[0]
+
+
+def load_memory(data: Optional[dict]) -> ContextWindow:
+    """A ContextWindow restored from the state's `memory` field."""
+    return ContextWindow(MEMORY_TOKENS, MEMORY_SUMMARY_TOKENS, _salience, MEMORY_TURNS).load(data)
+
+
+def remember(state, turn: str, reply_to: Optional[int] = None) -> None:
+    """
+    Append one turn (USER or ASSISTANT prefixed) to the state's memory. `reply_to`
+    is the sequence number (memory_count) of the user turn a deferred reply
+    answers, kept so merge_memory() can put the reply right after it.
+    """
+    memory = load_memory(state.memory)
+    memory.add(turn)
+    state.memory = memory.to_dict()
+    if reply_to is not None:
+        state.memory["reply_to"] = reply_to
+
+
+def memory_count(data: Optional[dict]) -> int:
+    """Sequence number of the last turn in a stored memory (0 when empty)."""
+    return load_memory(data).count
+
+
+def _added_since(memory: ContextWindow, count: int) -> List[str]:
+    new = memory.count - count
+    return memory.turns()[-new:] if new > 0 else []
+
+
+def merge_memory(base: Optional[dict], ours: dict, theirs: Optional[dict]) -> dict:
+    """
+    Memory after two concurrent updates of `base`: the turns `ours` added and those
+    `theirs` added (a deferred reply remembered by a worker). Each writer's turns are
+    found by sequence number, not text, so repeated messages survive; their turns go
+    right after the turn they reply to, which may be one of ours.
+    """
+    start = memory_count(base)
+    our_added = _added_since(load_memory(ours), start)
+    their_added = _added_since(load_memory(theirs), start)
+    split = min(max((theirs or {}).get("reply_to", start) - start, 0), len(our_added))
+    memory = load_memory(base)
+    memory.extend(our_added[:split] + their_added + our_added[split:])
+    return memory.to_dict()
+
+
+def message_tokens(messages: List[dict]) -> int:
+    return sum(estimate_tokens(m["content"]) + _MESSAGE_OVERHEAD for m in messages)
+
+
+def build_messages(
+    system_prompt: str, prompt: str, memory_data: Optional[dict] = None
+) -> List[dict]:
+    """
+    System prompt, summary of earlier turns, recent turns as chat messages, then
+    the step prompt. Oldest turns (then the summary) are dropped to fit PROMPT_TOKEN_CAP.
+    """
+    memory = load_memory(memory_data)
+    summary = memory.summary.render()
+    history = [
+        (
+            {"role": "user", "content": turn[len(USER) :]}
+            if turn.startswith(USER)
+            else {"role": "assistant", "content": turn[len(ASSISTANT) :]}
+        )
+        for turn in memory.turns()
+    ]
+    head = [{"role": "system", "content": system_prompt}]
+    tail = [{"role": "user", "content": prompt}]
+    context = [{"role": "system", "content": f"Conversation so far: {summary}"}] if summary else []
+
+    budget = PROMPT_TOKEN_CAP - message_tokens(head + tail)
+    while history and message_tokens(context + history) > budget:
+        history.pop(0)
+    if context and message_tokens(context + history) > budget:
+        context = []
+    messages = head + context + history + tail
+    _record(message_tokens(messages), len(history), bool(context))
+    return messages
+
+
+# -------- Metrics -------- #
+_stats = {"calls": 0, "prompt_tokens_total": 0, "prompt_tokens_max": 0, "last": {}}
+_stats_lock = threading.Lock()
+
+
+def _record(tokens, turns, summarized):
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["prompt_tokens_total"] += tokens
+        _stats["prompt_tokens_max"] = max(_stats["prompt_tokens_max"], tokens)
+        _stats["last"] = {"prompt_tokens": tokens, "history_turns": turns, "summary": summarized}
+
+
+def prompt_token_stats() -> dict:
+    """Estimated prompt tokens per chat completion (totals, max and the last call)."""
+    with _stats_lock:
+        out = dict(_stats)
+    out["prompt_tokens_avg"] = out["prompt_tokens_total"] / out["calls"] if out["calls"] else 0.0
+    return out
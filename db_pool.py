@@ -0,0 +1,220 @@
+# db_pool.py
+# Process-wide, thread-safe Postgres connection pool used by analytics.py.
+# Connections are borrowed with `pool.connection()` and returned on exit; broken,
+# stale or over-age connections are discarded and transparently replaced.
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import psycopg2
+
+# -------- Config (env) -------- #
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # seconds to wait for a free slot
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # recycle after N seconds
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))  # ping if idle longer
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the pool timeout."""
+
+
+class _Slot:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Minimal connection pool with health checks, max lifetime and reconnect.
+    `connect` is a zero-arg factory returning a new DB-API connection.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], object],
+        maxconn: int = DB_POOL_MAX,
+        timeout: float = DB_POOL_TIMEOUT,
+        max_lifetime: float = DB_POOL_MAX_LIFETIME,
+        healthcheck_idle: float = DB_POOL_HEALTHCHECK_IDLE,
+    ):
+        if maxconn < 1:
+            raise ValueError("DB pool size must be at least 1.")
+        self._connect = connect
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_idle = healthcheck_idle
+
+        self._idle = deque()  # of _Slot, most recently returned on the right
+        self._in_use = {}  # id(conn) -> _Slot
+        self._size = 0  # open connections (idle + in use)
+        self._cond = threading.Condition()
+        self._closed = False
+
+    # -------- Borrow / return -------- #
+    def getconn(self):
+        """Borrow a healthy connection, opening a new one if the pool has room."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed.")
+                slot = self._idle.pop() if self._idle else None
+                if slot is None:
+                    if self._size < self.maxconn:
+                        self._size += 1  # reserve the slot, connect outside the lock
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise PoolTimeout(
+                                f"No DB connection available after {self.timeout:.1f}s "
+                                f"(pool max {self.maxconn})."
+                            )
+                        self._cond.wait(remaining)
+                        continue
+
+            if slot is None:
+                try:
+                    slot = _Slot(self._connect())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_usable(slot):
+                self._discard(slot)
+                continue
+
+            with self._cond:
+                self._in_use[id(slot.conn)] = slot
+            return slot.conn
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        """Return a borrowed connection. Broken or aborted connections are closed instead."""
+        with self._cond:
+            slot = self._in_use.pop(id(conn), None)
+        if slot is None:
+            return
+
+        if not discard and not getattr(conn, "closed", 0):
+            try:
+                # Never hand out a connection mid-transaction.
+                conn.rollback()
+            except Exception:
+                discard = True
+        else:
+            discard = True
+
+        expired = time.monotonic() - slot.created_at > self.max_lifetime
+        if discard or expired:
+            self._discard(slot)
+            return
+
+        slot.last_used = time.monotonic()
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append(slot)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a `with` block."""
+        conn = self.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Connection-level failure: don't put a dead socket back in the pool.
+            self.putconn(conn, discard=True)
+            raise
+        except BaseException:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    # -------- Maintenance -------- #
+    def closeall(self) -> None:
+        """Close idle connections and refuse new borrows; in-use ones close on return."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for slot in idle:
+            self._close_quietly(slot.conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "max": self.maxconn,
+            }
+
+    def _is_usable(self, slot: _Slot) -> bool:
+        conn = slot.conn
+        if getattr(conn, "closed", 0):
+            return False
+        now = time.monotonic()
+        if now - slot.created_at > self.max_lifetime:
+            return False
+        if now - slot.last_used > self.healthcheck_idle:
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def _discard(self, slot: _Slot) -> None:
+        self._close_quietly(slot.conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# -------- Process-wide pool -------- #
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(connect: Callable[[], object]) -> ConnectionPool:
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(connect)
+    return _pool
+
+
+def reset_pool() -> None:
+    """Close and forget the process-wide pool (e.g. after fork or in tests)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
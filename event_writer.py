@@ -0,0 +1,128 @@
+# event_writer.py
+# Background, batched writer for analytics events. Callers enqueue rows without
+# blocking; a single daemon thread flushes them in multi-row batches when either
+# the batch size or the flush interval is reached, and drains on shutdown.
+
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+# -------- Config (env) -------- #
+ANALYTICS_QUEUE_SIZE = int(os.getenv("ANALYTICS_QUEUE_SIZE", "10000"))
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "200"))
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "1.0"))  # seconds
+
+_STOP = object()
+
+
+class EventWriter:
+    """
+    Bounded queue + flusher thread. `flush_rows(rows)` must write a whole batch
+    (e.g. one INSERT ... VALUES (...), (...) statement) or raise.
+    """
+
+    def __init__(
+        self,
+        flush_rows: Callable[[Sequence[tuple]], None],
+        max_queue: int = ANALYTICS_QUEUE_SIZE,
+        batch_size: int = ANALYTICS_BATCH_SIZE,
+        flush_interval: float = ANALYTICS_FLUSH_INTERVAL,
+    ):
+        self._flush_rows = flush_rows
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {"enqueued": 0, "dropped": 0, "flushed": 0, "failed": 0, "batches": 0}
+
+    # -------- Producer side -------- #
+    def enqueue(self, row: tuple) -> bool:
+        """Queue one row. Returns False (and counts a drop) if the queue is full."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._bump("dropped")
+            return False
+        self._bump("enqueued")
+        return True
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Flush everything queued so far and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+        out["queued"] = self._queue.qsize()
+        return out
+
+    # -------- Writer thread -------- #
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="analytics-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        batch: List[tuple] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._drain_into(batch)
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _drain_into(self, batch: List[tuple]) -> None:
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP:
+                batch.append(item)
+
+    def _flush(self, batch: List[tuple]) -> None:
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start : start + self.batch_size]
+            try:
+                self._flush_rows(chunk)
+            except Exception as e:
+                self._bump("failed", len(chunk))
+                print(f"[Analytics Error] Failed to flush {len(chunk)} events: {e}")
+            else:
+                self._bump("flushed", len(chunk))
+                self._bump("batches")
+
+    def _bump(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[key] += n
@@ -1,15 +1,23 @@
 # guardrail.py
 import os
+import time
+import atexit
 import asyncio
+import itertools
 import threading
+from collections import OrderedDict
 from openai import AsyncOpenAI
-from twilio.rest import Client as TwilioClient
 
-# Init async OpenAI + Twilio clients
+from context_window import ContextWindow, estimate_tokens
+from outbound import get_outbound_sender
+from prescreen import GUARDRAIL_PRESCREEN, prescreen, score_text
+
+# Init async OpenAI client (messages go out through outbound.py)
 client = AsyncOpenAI()
-twilio_client = TwilioClient(os.getenv("TWILIO_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
 
-TWILIO_NUMBER = "whatsapp:+14155238886"  # replace with your Twilio number whatsapp:+ 18335661105
+CRISIS_COOLDOWN = float(
+    os.getenv("CRISIS_COOLDOWN", "900")
+)  # seconds between crisis notices per user
 
 GUARDRAIL_SYSTEM_PROMPT = """
 You are AllyAI’s Safety Guardrail Agent.
@@ -40,11 +48,10 @@ Only return the label (SAFE, DISTRESS, or CRISIS) as plain text.
 """
 
 
-async def classify_message_async(history, new_input):
-    """Classify message into SAFE / DISTRESS / CRISIS using LLM"""
-    prompt = f"""
+def build_classifier_prompt(context, new_input):
+    return f"""
 Conversation so far:
-{history}
+{context or "(no earlier messages)"}
 
 Latest message:
 {new_input}
@@ -52,6 +59,11 @@ Latest message:
 Classify into: SAFE / DISTRESS / CRISIS
 (Choose SAFE unless there is clear, explicit crisis per the rules.)
 """
+
+
+async def classify_message_async(context, new_input):
+    """Classify message into SAFE / DISTRESS / CRISIS using LLM"""
+    prompt = build_classifier_prompt(context, new_input)
     resp = await client.chat.completions.create(
         model="gpt-4o-mini",
         messages=[
@@ -63,29 +75,296 @@ Classify into: SAFE / DISTRESS / CRISIS
     return resp.choices[0].message.content.strip().upper()
 
 
-def launch_guardrail_check(user_id, history, user_input):
-    """Run guardrail in a background thread so it never blocks Flask"""
-
-    async def runner():
-        classification = await classify_message_async(history, user_input)
-
-        # Only interrupt on CRISIS; do not interrupt on DISTRESS (minimal change).
-        if classification == "CRISIS":
-            twilio_client.messages.create(
-                body=(
-                    "💛 I hear how heavy this feels. Please know you’re not alone.\n\n"
-                    "📞 If you’re in immediate danger or thinking of hurting yourself, "
-                    "consider contacting local emergency services, or visit https://findahelpline.com "
-                    "to find support in your area."
-                ),
-                from_=TWILIO_NUMBER,
-                to=user_id,
+CRISIS_MESSAGE = (
+    "💛 I hear how heavy this feels. Please know you’re not alone.\n\n"
+    "📞 If you’re in immediate danger or thinking of hurting yourself, "
+    "consider contacting local emergency services, or visit https://findahelpline.com "
+    "to find support in your area."
+)
+
+
+# -------- Classifier context -------- #
+# Instead of the raw history, each user gets a ContextWindow: recent turns under
+# GUARDRAIL_CONTEXT_TOKENS plus an incremental summary that keeps excerpts of
+# older turns with risk cues. Checks run on the guardrail loop thread, and inline on
+# request threads after the service stopped, so both are guarded by _context_lock.
+GUARDRAIL_CONTEXT_TOKENS = int(os.getenv("GUARDRAIL_CONTEXT_TOKENS", "400"))
+GUARDRAIL_SUMMARY_TOKENS = int(os.getenv("GUARDRAIL_SUMMARY_TOKENS", "120"))
+GUARDRAIL_CONTEXT_USERS = int(os.getenv("GUARDRAIL_CONTEXT_USERS", "10000"))  # LRU size
+
+_contexts = OrderedDict()  # user_id -> ContextWindow
+_token_stats = {"checks": 0, "prompt_tokens_total": 0, "prompt_tokens_max": 0, "last": {}}
+_context_lock = threading.Lock()
+
+
+def _risk_salience(turn):
+    return score_text(turn)[0]
+
+
+def build_guardrail_context(user_id, history, user_input):
+    """Update the user's context window from a history snapshot; returns (text, token counts)."""
+    history = list(history)
+    if history and history[-1] == f"User: {user_input}":
+        history = history[:-1]  # the latest message is shown on its own
+    with _context_lock:
+        window = _contexts.pop(user_id, None)
+        if window is None:
+            window = ContextWindow(
+                GUARDRAIL_CONTEXT_TOKENS, GUARDRAIL_SUMMARY_TOKENS, _risk_salience
             )
+        _contexts[user_id] = window
+        while len(_contexts) > GUARDRAIL_CONTEXT_USERS:
+            _contexts.popitem(last=False)
+        window.sync(history)
+        return window.render()
+
+
+def guardrail_token_stats():
+    """Prompt token totals across checks, plus the breakdown of the most recent one."""
+    with _context_lock:
+        out = dict(_token_stats)
+    out["prompt_tokens_avg"] = out["prompt_tokens_total"] / out["checks"] if out["checks"] else 0.0
+    return out
+
+
+def _record_tokens(counts):
+    with _context_lock:
+        _token_stats["checks"] += 1
+        _token_stats["prompt_tokens_total"] += counts["prompt_tokens"]
+        _token_stats["prompt_tokens_max"] = max(
+            _token_stats["prompt_tokens_max"], counts["prompt_tokens"]
+        )
+        _token_stats["last"] = counts
+
+
+async def run_guardrail_check(user_id, history, user_input):
+    """Classify one message and send the crisis notice if needed."""
+    context, counts = build_guardrail_context(user_id, history, user_input)
+    counts["prompt_tokens"] = estimate_tokens(GUARDRAIL_SYSTEM_PROMPT) + estimate_tokens(
+        build_classifier_prompt(context, user_input)
+    )
+    _record_tokens(counts)
+    classification = await classify_message_async(context, user_input)
+
+    # Only interrupt on CRISIS; do not interrupt on DISTRESS (minimal change).
+    if classification == "CRISIS":
+        # Async send; repeats within CRISIS_COOLDOWN (a burst of messages) are suppressed
+        await get_outbound_sender().send(
+            user_id, CRISIS_MESSAGE, dedup_key="crisis", cooldown=CRISIS_COOLDOWN
+        )
+
+    # If SAFE or DISTRESS: do nothing here (no interruption).
+    # If you want the main chat to adapt tone, you can store `classification` in session state.
+    return classification
+
+
+# -------- Guardrail service -------- #
+GUARDRAIL_QUEUE_SIZE = int(os.getenv("GUARDRAIL_QUEUE_SIZE", "1000"))
+GUARDRAIL_CONCURRENCY = int(os.getenv("GUARDRAIL_CONCURRENCY", "8"))
+GUARDRAIL_DRAIN_TIMEOUT = float(os.getenv("GUARDRAIL_DRAIN_TIMEOUT", "15"))  # seconds
+
+PRIORITY_RISK = 0  # prescreen found explicit crisis cues
+PRIORITY_NORMAL = 1
+
+
+class GuardrailService:
+    """
+    One long-lived event loop thread per process running guardrail checks.
+    At most `queue_size` normal checks are outstanding (queued or running) and at
+    most `concurrency` run at once; lower `priority` values run first. Risk checks
+    are never dropped. `stop()` waits for outstanding checks, so pending CRISIS
+    checks are not lost at shutdown.
+    """
+
+    def __init__(
+        self,
+        check=run_guardrail_check,
+        queue_size=GUARDRAIL_QUEUE_SIZE,
+        concurrency=GUARDRAIL_CONCURRENCY,
+    ):
+        self._check = check
+        self.concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(queue_size)  # bounds outstanding jobs
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._outstanding = 0
+        self._accepting = True
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._seq = itertools.count()  # FIFO within a priority
+        self._counters = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "dropped": 0,
+            "over_limit": 0,  # risk checks queued past `queue_size`
+            "inline": 0,  # risk checks run on the caller's thread after stop()
+        }
+        self._latency = {"wait_total": 0.0, "wait_max": 0.0, "run_total": 0.0, "run_max": 0.0}
+
+    # -------- Producer side (any thread) -------- #
+    def submit(self, user_id, history, user_input, priority=PRIORITY_NORMAL) -> bool:
+        """
+        Queue a check; never blocks the caller. A normal check is dropped (False)
+        when the queue is full. A risk check goes past the limit instead, and after
+        stop() it runs inline.
+        """
+        with self._lock:  # checked and started together, so stop() can't leave a new loop behind
+            accepting = self._accepting
+            holds_slot = accepting and self._slots.acquire(blocking=False)
+            queued = holds_slot or (accepting and priority == PRIORITY_RISK)
+            if queued:
+                self._start()
+                self._outstanding += 1
+                self._counters["submitted"] += 1
+                if not holds_slot:
+                    self._counters["over_limit"] += 1
+            elif priority != PRIORITY_RISK:
+                self._counters["dropped"] += 1
+        if not queued:
+            if priority == PRIORITY_RISK:
+                return self._run_inline(user_id, history, user_input)
+            print(f"[Guardrail] Queue full, dropped check for {user_id}")
+            return False
+        job = (
+            priority,
+            next(self._seq),
+            time.monotonic(),
+            user_id,
+            history,
+            user_input,
+            holds_slot,
+        )
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return True
+
+    def _run_inline(self, user_id, history, user_input) -> bool:
+        """Run a risk check on the caller's thread once the service has stopped."""
+        with self._lock:
+            self._counters["inline"] += 1
+        try:
+            asyncio.run(self._check(user_id, history, user_input))
+            outcome = "completed"
+        except Exception as e:
+            outcome = "failed"
+            print(f"[Guardrail Error] Inline check for {user_id} failed: {e}")
+        with self._lock:
+            self._counters[outcome] += 1
+        return True
+
+    def stop(self, timeout=GUARDRAIL_DRAIN_TIMEOUT) -> bool:
+        """Stop accepting checks, wait for outstanding ones, then stop the loop."""
+        with self._idle:
+            self._accepting = False
+            drained = self._idle.wait_for(lambda: self._outstanding == 0, timeout)
+        if self._thread is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+            self._thread.join(timeout=1)
+        return drained
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+            out["queue_depth"] = self._outstanding
+            done = out["completed"] + out["failed"]
+            out["avg_wait_s"] = self._latency["wait_total"] / done if done else 0.0
+            out["max_wait_s"] = self._latency["wait_max"]
+            out["avg_check_s"] = self._latency["run_total"] / done if done else 0.0
+            out["max_check_s"] = self._latency["run_max"]
+        return out
+
+    # -------- Loop thread -------- #
+    def _start(self):
+        """Start the loop thread on first use; the caller holds `self._lock`."""
+        if self._thread is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._queue = asyncio.PriorityQueue()
+        started = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(started,), name="guardrail", daemon=True
+        )
+        self._thread.start()
+        started.wait()
+
+    def _run(self, started):
+        asyncio.set_event_loop(self._loop)
+        for _ in range(self.concurrency):
+            self._loop.create_task(self._worker())
+        self._loop.call_soon(started.set)
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _shutdown(self):
+        workers = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        asyncio.get_running_loop().stop()
+
+    async def _worker(self):
+        while True:
+            _, _, queued_at, user_id, history, user_input, holds_slot = await self._queue.get()
+            started = time.monotonic()
+            try:
+                await self._check(user_id, history, user_input)
+                outcome = "completed"
+            except Exception as e:
+                outcome = "failed"
+                print(f"[Guardrail Error] Check for {user_id} failed: {e}")
+            finished = time.monotonic()
+            with self._lock:
+                self._counters[outcome] += 1
+                wait, run = started - queued_at, finished - started
+                self._latency["wait_total"] += wait
+                self._latency["wait_max"] = max(self._latency["wait_max"], wait)
+                self._latency["run_total"] += run
+                self._latency["run_max"] = max(self._latency["run_max"], run)
+                self._outstanding -= 1
+                self._idle.notify_all()
+            if holds_slot:
+                self._slots.release()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_guardrail_service():
+    """Return the process-wide guardrail service, creating it on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = GuardrailService()
+                atexit.register(_service.stop)
+    return _service
+
+
+# Prescreen outcomes, to report how many LLM calls the local tier avoided
+_prescreen_counts = {"risk": 0, "ambiguous": 0, "safe": 0}
+_prescreen_lock = threading.Lock()
+
+
+def launch_guardrail_check(user_id, history, user_input):
+    """Queue a guardrail check on the background service so it never blocks Flask"""
+    if not GUARDRAIL_PRESCREEN:
+        return get_guardrail_service().submit(user_id, history, user_input)
 
-        # If SAFE or DISTRESS: do nothing here (no interruption).
-        # If you want the main chat to adapt tone, you can store `classification` in session state.
+    tier = prescreen(user_input, history).tier
+    with _prescreen_lock:
+        _prescreen_counts[tier] += 1
+    if tier == "safe":
+        return False  # clearly benign: no LLM call
+    priority = PRIORITY_RISK if tier == "risk" else PRIORITY_NORMAL
+    return get_guardrail_service().submit(user_id, history, user_input, priority=priority)
 
-    def run_in_thread():
-        asyncio.run(runner())
 
-    threading.Thread(target=run_in_thread, daemon=True).start()
+def prescreen_stats():
+    """Prescreen tier counts and the fraction of messages that skipped the LLM check."""
+    with _prescreen_lock:
+        out = dict(_prescreen_counts)
+    total = sum(out.values())
+    out["llm_avoided_ratio"] = out["safe"] / total if total else 0.0
+    return out
@@ -71,6 +71,11 @@ _STEP_NEXT = {
 }
 
 
+def next_step(current: str) -> str:
+    """Return the step that follows `current` (unknown steps go to 'closing')."""
+    return _STEP_NEXT.get(current or "validation_exploration", "closing")
+
+
 def update_user_step(user_state: Dict[str, dict], user_id: str) -> None:
     """
     Advance the user's conversation step in the in-memory user_state.
@@ -78,8 +83,7 @@ def update_user_step(user_state: Dict[str, dict], user_id: str) -> None:
     """
     if user_id not in user_state:
         user_state[user_id] = {"current_step": "validation_exploration"}
-    current = user_state[user_id].get("current_step") or "validation_exploration"
-    user_state[user_id]["current_step"] = _STEP_NEXT.get(current, "closing")
+    user_state[user_id]["current_step"] = next_step(user_state[user_id].get("current_step"))
 
 
 # -------- Prompt builder -------- #
@@ -0,0 +1,187 @@
+# llm.py
+# Per-step model routing for the chat completions. Each conversation step
+# (helpers._STEP_NEXT) maps to a model and a latency budget. If the primary
+# model hasn't answered within its budget (or fails), a hedged request goes to
+# the route's faster fallback model and the first good answer wins. Latencies
+# are recorded per route/model in a histogram for tuning the table.
+#
+# Override routes with LLM_ROUTES, e.g.
+#   LLM_ROUTES='{"closing": {"model": "gpt-4o-mini", "budget": 3, "fallback": null}}'
+
+import os
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, NamedTuple, Optional
+
+from helpers import _STEP_NEXT
+from metrics import Histogram
+
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+# Threads for sync requests; a caller uses up to two (primary + hedge), so size it at
+# about twice the threads that call complete() (webhook threads + REPLY_WORKERS)
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "16"))
+FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gpt-4o-mini")
+
+
+class Route(NamedTuple):
+    model: str
+    budget: float  # seconds before the hedged request to `fallback` is sent
+    fallback: Optional[str] = None
+
+
+DEFAULT_ROUTE = Route("gpt-4", 8.0, FAST_MODEL)
+_DEFAULT_ROUTES = {
+    "validation_exploration": Route("gpt-4", 6.0, FAST_MODEL),
+    "psychoeducation": Route("gpt-4", 8.0, FAST_MODEL),
+    "empowerment": Route("gpt-4", 8.0, FAST_MODEL),
+    "offer_message_help": Route("gpt-4", 8.0, FAST_MODEL),
+    "drafting_message": Route("gpt-4", 10.0, FAST_MODEL),
+    "closing": Route(FAST_MODEL, 4.0, None),  # short sign-off; no need for the slow model
+}
+
+
+def load_routes(spec: Optional[str] = None) -> Dict[str, Route]:
+    """Default table, with per-step overrides from LLM_ROUTES (JSON)."""
+    routes = {step: _DEFAULT_ROUTES.get(step, DEFAULT_ROUTE) for step in _STEP_NEXT}
+    spec = os.getenv("LLM_ROUTES", "") if spec is None else spec
+    if spec:
+        for step, override in json.loads(spec).items():
+            base = routes.get(step, DEFAULT_ROUTE)
+            routes[step] = base._replace(**override)
+    return routes
+
+
+ROUTES = load_routes()
+
+llm_latency = Histogram(
+    "allyai_llm_latency_seconds",
+    "Chat completion latency by step route, model and outcome",
+    labelnames=("route", "model", "outcome"),
+)
+_counters = {"requests": 0, "hedged": 0, "fallback_wins": 0, "errors": 0}
+_counters_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm")
+# One slot per executor thread: a call is only submitted when a thread is free, so a
+# hedge never queues behind the slow calls it is meant to get around
+_slots = threading.BoundedSemaphore(LLM_HEDGE_WORKERS)
+
+
+def route_for(step: str) -> Route:
+    return ROUTES.get(step, DEFAULT_ROUTE)
+
+
+def routing_stats() -> dict:
+    """Hedging counters plus latency percentiles per (route, model, outcome)."""
+    with _counters_lock:
+        out = dict(_counters)
+    out["latency"] = {"/".join(key): value for key, value in llm_latency.snapshot().items()}
+    return out
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _timed_call(create, step, model, messages):
+    """One completion with its latency recorded; returns the reply text."""
+    started = time.monotonic()
+    try:
+        resp = create(model=model, messages=messages, temperature=LLM_TEMPERATURE)
+    except Exception:
+        llm_latency.observe(time.monotonic() - started, route=step, model=model, outcome="error")
+        raise
+    llm_latency.observe(time.monotonic() - started, route=step, model=model, outcome="ok")
+    return resp.choices[0].message.content.strip()
+
+
+async def _timed_call_async(create, step, model, messages):
+    started = time.monotonic()
+    try:
+        resp = await create(model=model, messages=messages, temperature=LLM_TEMPERATURE)
+    except asyncio.CancelledError:
+        llm_latency.observe(
+            time.monotonic() - started, route=step, model=model, outcome="cancelled"
+        )
+        raise
+    except Exception:
+        llm_latency.observe(time.monotonic() - started, route=step, model=model, outcome="error")
+        raise
+    llm_latency.observe(time.monotonic() - started, route=step, model=model, outcome="ok")
+    return resp.choices[0].message.content.strip()
+
+
+def _submit(create, step, model, messages, wait_for_slot=True):
+    """Start one call on the pool, or return None if no thread is free (and we may not wait)."""
+    if not _slots.acquire(blocking=wait_for_slot):
+        return None
+    future = _executor.submit(_timed_call, create, step, model, messages)
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def complete(client, step, messages) -> str:
+    """Routed, hedged completion with a sync OpenAI client. Raises if every attempt fails."""
+    route = route_for(step)
+    _count("requests")
+    create = client.chat.completions.create
+    primary = _submit(create, step, route.model, messages)
+    pending, hedge, error = {primary}, None, None
+    try:
+        done, _ = wait(pending, timeout=route.budget)
+        if route.fallback is not None and not (done and primary.exception() is None):
+            # Primary is slow or failed: hedge to the fallback if a thread is free now
+            # (when the pool is saturated, hedging would only add load)
+            hedge = _submit(create, step, route.fallback, messages, wait_for_slot=False)
+            if hedge is not None:
+                _count("hedged")
+                pending.add(hedge)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        _count("fallback_wins")
+                    return future.result()  # a slow primary finishes in the background
+                error = future.exception()
+        _count("errors")
+        raise error
+    finally:
+        for future in pending:
+            future.cancel()  # calls that haven't started never will
+
+
+async def complete_async(client, step, messages) -> str:
+    """Routed, hedged completion with an AsyncOpenAI client; the losing request is cancelled."""
+    route = route_for(step)
+    _count("requests")
+    create = client.chat.completions.create
+    primary = asyncio.ensure_future(_timed_call_async(create, step, route.model, messages))
+    done, _ = await asyncio.wait({primary}, timeout=route.budget)
+    if route.fallback is None or (done and primary.exception() is None):
+        try:
+            return await primary
+        except Exception:
+            _count("errors")
+            raise
+
+    _count("hedged")
+    hedge = asyncio.ensure_future(_timed_call_async(create, step, route.fallback, messages))
+    pending, error = {primary, hedge}, None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        _count("fallback_wins")
+                    return task.result()
+                error = task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+    _count("errors")
+    raise error
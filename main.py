@@ -1,18 +1,38 @@
 # main.py
 from flask import Flask, request
-from twilio.twiml.messaging_response import MessagingResponse
+from twilio.twiml.messaging_response import Message, MessagingResponse
 from guardrail import launch_guardrail_check
+from outbound import get_outbound_sender
 from flask_cors import CORS
 from openai import OpenAI
-from analytics import init_db, log_event, create_or_update_user, get_user_profile
+from analytics import init_db, log_event, UserUnitOfWork
+from state_store import (
+    ConversationState,
+    StateConflict,
+    create_state_store,
+    decode_record,
+    encode_record,
+)
+from reply_dispatcher import ReplyDispatcher
+import llm
+from response_cache import RESPONSE_CACHE_FILE, ResponseCache
+from conversation_memory import (
+    ASSISTANT,
+    USER,
+    build_messages,
+    memory_count,
+    merge_memory,
+    remember,
+)
 import os
 import json
+from typing import NamedTuple
 
 # --- Imports from helpers and assessment (moved out of this file) ---
 from helpers import (
     ALLYAI_SYSTEM_PROMPT,
     is_relevant,
-    update_user_step,
+    next_step,
     generate_prompt,
     detect_intent,
 )
@@ -42,14 +62,34 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 with open(os.path.join(BASE_DIR, "tracks.json"), "r", encoding="utf-8") as f:
     TRACKS = json.load(f)
 
-# Track user states
-user_state = {}
-user_profiles = {}
-user_sessions = {}
+# Conversation state per user (stage, scenario, assessment progress, history).
+# Shared across workers when STATE_STORE points at SQLite or Postgres.
+STATE_STORE = create_state_store()
 
 # OpenAI client
 client = OpenAI()
 
+# Deferred replies: answer the webhook right away and send GPT replies via the REST API
+DEFERRED_REPLIES = os.getenv("DEFERRED_REPLIES", "0") == "1"
+
+GPT_ERROR_REPLY = "Something went wrong while generating a response. Please try again or type 'restart' to start over."
+
+
+def send_whatsapp(to, body):
+    """Send a message outside the webhook response (used for deferred replies)."""
+    get_outbound_sender().send_sync(to, body)
+
+
+reply_dispatcher = ReplyDispatcher(send_whatsapp)
+
+# Cached GPT replies for built-in scenarios (pre-generated with `python response_cache.py warm`)
+response_cache = ResponseCache()
+if response_cache.steps and os.path.exists(RESPONSE_CACHE_FILE):
+    try:
+        print(f"[Response Cache] Loaded {response_cache.load(RESPONSE_CACHE_FILE)} entries")
+    except Exception as e:
+        print(f"[Response Cache Error] Could not load {RESPONSE_CACHE_FILE}: {e}")
+
 
 # health route
 @app.route("/health", methods=["GET"])
@@ -62,25 +102,88 @@ def health():
 def bot():
     from_number = request.values.get("From")
     incoming_msg = request.values.get("Body", "").strip()
-    log_event(
-        from_number,
-        "message_received",
-        {"input": incoming_msg, "stage": user_state.get(from_number, {}).get("stage", "unknown")},
-    )
 
     response = MessagingResponse()
-    msg = response.message()
+    msg = Message()
+
+    # One profile read and at most one write (plus events) per message
+    uow = UserUnitOfWork(from_number)
+    state, version, before = load_conversation(from_number)
+    try:
+        turn = handle_message(from_number, incoming_msg, msg, uow, state)
+        if turn is not None:
+            run_gpt_turn(from_number, turn, msg, uow, state)
+    finally:
+        uow.commit()
+        save_conversation(from_number, state, version, before)
+
+    # A deferred reply leaves the message empty: acknowledge with a bare <Response/>
+    if msg.verbs:
+        response.append(msg)
+    return str(response)
+
+
+def load_conversation(from_number):
+    """Fetch the user's ConversationState, its store version and its encoded form."""
+    record, version = STATE_STORE.get(from_number) if from_number else (None, 0)
+    before = encode_record(record) if record is not None else None
+    return ConversationState.from_dict(record), version, before
+
+
+def save_conversation(from_number, state, version, before):
+    """
+    Persist the state if this message changed it. On a conflict, a concurrent
+    memory-only write (a deferred reply) is merged in; otherwise the first writer wins.
+    """
+    if not from_number or state.stage is None:
+        return
+    record = state.to_dict()
+    if encode_record(record) == before:
+        return
+    try:
+        STATE_STORE.put(from_number, record, version)
+    except StateConflict:
+        if not merge_concurrent_memory(from_number, record, before):
+            print(f"[State] Concurrent update for {from_number}; keeping the other worker's state")
+
+
+def _without_memory(record):
+    return {k: v for k, v in (record or {}).items() if k != "memory"}
+
+
+def merge_concurrent_memory(from_number, record, before):
+    """Save `record` on top of a write that only added memory turns; returns whether it did."""
+    latest, version = STATE_STORE.get(from_number)
+    base = decode_record(before) if before is not None else None
+    if latest is None or record.get("memory") is None:
+        return False
+    if _without_memory(latest) != _without_memory(base):
+        return False
+    memory = merge_memory((base or {}).get("memory"), record["memory"], latest.get("memory"))
+    record = dict(record, memory=memory)
+    try:
+        STATE_STORE.put(from_number, record, version)
+    except StateConflict:
+        return False
+    return True
+
+
+def handle_message(from_number, incoming_msg, msg, uow, state):
+    """
+    Run one incoming message through the stage machine, writing the reply into `msg`.
+    Returns a GptTurn when the reply still needs a chat completion, otherwise None.
+    """
+    uow.log_event("message_received", {"input": incoming_msg, "stage": state.stage or "unknown"})
 
     # ✅ Restart handling
     if incoming_msg.lower() == "restart":
-        log_event(from_number, "user_restarted", {})
+        uow.log_event("user_restarted", {})
 
-        # Reset in-memory state
-        user_state[from_number] = {"stage": "choose_path"}
-        user_sessions.pop(from_number, None)  # clear any unfinished assessments
+        # Reset conversation state (also clears any unfinished assessment)
+        state.reset("choose_path")
 
         # Fetch saved name from DB
-        profile = get_user_profile(from_number)
+        profile = uow.profile
         if profile and profile.get("name"):
             msg.body(
                 f"Hi {profile['name']} 👋 Starting fresh!\n\n"
@@ -92,17 +195,17 @@ def bot():
         else:
             msg.body("Let's start over. 👋 What’s your name?")
 
-        return str(response)
+        return
 
     print(f"📲 from_number = {from_number}")
     print(f"📥 incoming_msg = {incoming_msg}")
 
     if not from_number or from_number.strip() == "":
         msg.body("Oops — I couldn’t detect your phone number. Try again later.")
-        return str(response)
+        return
 
-    if from_number not in user_state:
-        profile = get_user_profile(from_number)
+    if state.stage is None:
+        profile = uow.profile
         if profile and profile.get("name"):
             # Returning user with a saved name
             msg.body(
@@ -112,35 +215,26 @@ def bot():
                 "2. Take a quick assessment\n"
                 "3. Play 'What Would You Do?'"
             )
-            user_state[from_number] = {"stage": "choose_path"}
-            return str(response)
+            state.stage = "choose_path"
+            return
         else:
             # New user
-            log_event(from_number, "user_started_session", {})
+            uow.log_event("user_started_session", {})
             print("🆕 New user detected:", from_number)
-            user_state[from_number] = {"stage": "intro"}
-            user_profiles[from_number] = {}
+            state.stage = "intro"
             msg.body(
                 "Hi, I'm Ally 👋\nI'm here to support you in understanding your relationships and yourself better.\n\nWhat’s your name?"
             )
-            return str(response)
-
-    # ✅ Fallback if stage is missing
-    if "stage" not in user_state[from_number]:
-        user_state[from_number]["stage"] = "intro"
-        msg.body("Hi, I'm Ally 👋\nWhat’s your name?")
-        return str(response)
-
-    state = user_state[from_number]
+            return
 
     # ✅ Only respond to name once during intro
-    if state["stage"] == "intro":
-        profile = get_user_profile(from_number)
+    if state.stage == "intro":
+        profile = uow.profile
         if not profile or not profile.get("name"):
             name = incoming_msg.title()
             # ✅ Save directly to DB
-            create_or_update_user(from_number, name=name)
-            user_state[from_number]["stage"] = "choose_path"
+            uow.update(name=name)
+            state.stage = "choose_path"
             msg.body(
                 f"Nice to meet you, {name}!\n\nHow can I help you today?\n"
                 "1. Ask for advice\n"
@@ -155,22 +249,22 @@ def bot():
                 "2. Take a quick assessment\n"
                 "3. Play 'What Would You Do?'"
             )
-        return str(response)
+        return
 
-    if state["stage"] == "choose_path":
+    if state.stage == "choose_path":
         if incoming_msg == "1":
-            user_state[from_number]["stage"] = "choose_category"
+            state.stage = "choose_category"
             msg.body(
                 "Choose a topic you want to talk about:\n1. Romantic Partner Issues\n2. Friendship Challenges\n3. Family Tensions\n4. Building Self-Confidence\n5. Overcoming Insecurity\n6. Urgent Advice"
             )
         elif incoming_msg == "2":
-            user_sessions[from_number] = {"current_q": 0, "answers": []}
-            user_state[from_number]["stage"] = "assessment"
-            first_q = get_next_assessment_question(user_sessions, from_number)
+            state.assessment = {"current_q": 0, "answers": []}
+            state.stage = "assessment"
+            first_q = get_next_assessment_question({from_number: state.assessment}, from_number)
             msg.body("Let’s begin! ✨\n\n" + first_q)
-            log_event(from_number, "assessment_started", {})
+            uow.log_event("assessment_started", {})
         elif incoming_msg == "3":
-            profile = get_user_profile(from_number)
+            profile = uow.profile or {}
             track = profile.get("chosen_track")
             day = profile.get("current_day", 1)
             points = profile.get("points", 0)
@@ -186,7 +280,7 @@ def bot():
                     "2. Take a quick assessment\n"
                     "3. Play 'What Would You Do?'"
                 )
-                user_state[from_number]["stage"] = "choose_path"
+                state.stage = "choose_path"
 
             elif track and day <= TOTAL_DAYS:
                 # ✅ Already in progress
@@ -196,11 +290,11 @@ def bot():
                     "1. Continue to your next lesson\n"
                     "2. Back to main menu"
                 )
-                user_state[from_number]["stage"] = "track_progress_options"
+                state.stage = "track_progress_options"
 
             else:
                 # ✅ No track chosen yet
-                user_state[from_number]["stage"] = "choose_track"
+                state.stage = "choose_track"
                 msg.body(
                     "🎲 Welcome to *What Would You Do?*\n\n"
                     "Pick a growth path:\n"
@@ -209,12 +303,12 @@ def bot():
                     "3. Setting Boundaries & Saying No"
                 )
 
-            return str(response)
+            return
         else:
             msg.body("Please reply with 1, 2, or 3.")
-        return str(response)
+        return
 
-    if state["stage"] == "choose_track":
+    if state.stage == "choose_track":
         track_map = {
             "1": "Building Confidence",
             "2": "Recognizing Red Flags",
@@ -223,9 +317,7 @@ def bot():
         selected = track_map.get(incoming_msg)
         if selected and selected in TRACKS and len(TRACKS[selected]) > 0:
             # ✅ Save progress directly to DB
-            create_or_update_user(
-                from_number, chosen_track=selected, current_day=1, points=0, streak=0
-            )
+            uow.update(chosen_track=selected, current_day=1, points=0, streak=0)
 
             # Load Day 1 lesson
             day_data = TRACKS[selected][0]
@@ -239,13 +331,13 @@ def bot():
                 f"{options_text}\n\n"
                 "👉 Reply with A, B, or C"
             )
-            user_state[from_number]["stage"] = "track_active"
+            state.stage = "track_active"
         else:
             msg.body("Please choose a valid track: 1, 2, or 3.")
-        return str(response)
+        return
 
-    if state["stage"] == "track_progress_options":
-        profile = get_user_profile(from_number)
+    if state.stage == "track_progress_options":
+        profile = uow.profile
         track = profile.get("chosen_track")
         day = profile.get("current_day", 1)
         points = profile.get("points", 0)
@@ -264,7 +356,7 @@ def bot():
                     f"C) {lesson['options']['C']}\n\n"
                     "👉 Reply with A, B, or C"
                 )
-                user_state[from_number]["stage"] = "track_active"
+                state.stage = "track_active"
             else:
                 msg.body(
                     f"🎉 You’ve already completed all {TOTAL_DAYS} lessons! 💛\n"
@@ -274,7 +366,7 @@ def bot():
                     "2. Take a quick assessment\n"
                     "3. Play 'What Would You Do?'"
                 )
-                user_state[from_number]["stage"] = "choose_path"
+                state.stage = "choose_path"
 
         elif incoming_msg == "2":  # Back to main menu
             msg.body(
@@ -283,15 +375,15 @@ def bot():
                 "2. Take a quick assessment\n"
                 "3. Play 'What Would You Do?'"
             )
-            user_state[from_number]["stage"] = "choose_path"
+            state.stage = "choose_path"
 
         else:
             msg.body("Please reply with 1 or 2.")
 
-        return str(response)
+        return
 
-    if state["stage"] == "track_active":
-        profile = get_user_profile(from_number)
+    if state.stage == "track_active":
+        profile = uow.profile
         track = profile.get("chosen_track")
         day = profile.get("current_day", 1)
         points = profile.get("points", 0)
@@ -302,7 +394,7 @@ def bot():
         choice = incoming_msg.strip().upper()
         if choice not in ["A", "B", "C"]:
             msg.body("Please reply with A, B, or C.")
-            return str(response)
+            return
 
         # Award points
         points += 10
@@ -310,7 +402,7 @@ def bot():
 
         # Update DB progress
         next_day = day + 1
-        create_or_update_user(from_number, chosen_track=track, current_day=next_day, points=points)
+        uow.update(chosen_track=track, current_day=next_day, points=points)
 
         TOTAL_DAYS = 4
         if next_day <= TOTAL_DAYS:
@@ -323,7 +415,7 @@ def bot():
                 "1. Go to the next lesson\n"
                 "2. Back to the main menu"
             )
-            user_state[from_number]["stage"] = "track_progress_options"
+            state.stage = "track_progress_options"
         else:
             msg.body(
                 f"💡 Feedback:\n{feedback}\n\n"
@@ -336,11 +428,11 @@ def bot():
                 "2. Take a quick assessment\n"
                 "3. Play 'What Would You Do?'"
             )
-            user_state[from_number]["stage"] = "choose_path"
+            state.stage = "choose_path"
 
-        return str(response)
+        return
 
-    if state["stage"] == "choose_category":
+    if state.stage == "choose_category":
         category_map = {
             "1": "Romantic Partner Issues",
             "2": "Friendship Challenges",
@@ -352,47 +444,46 @@ def bot():
         selected = category_map.get(incoming_msg)
         if selected:
             # ✅ only save in memory, don’t push to DB
-            user_state[from_number]["category"] = selected
+            state.category = selected
 
-            user_state[from_number]["stage"] = "choose_scenario"
+            state.stage = "choose_scenario"
 
             options = [s["scenario"] for s in SCENARIOS if s["category"] == selected]
             options.append("Something else — I want to describe my situation in my own words.")
 
-            user_state[from_number]["scenario_options"] = options
+            state.scenario_options = options
             option_text = "\n".join([f"{i+1}. {s}" for i, s in enumerate(options)])
             msg.body(
                 f"Thanks! Here are some common situations under *{selected}*:\n\n"
                 f"{option_text}\n\n"
                 "Reply with the number that fits your situation."
             )
-            log_event(from_number, "category_selected", {"category": selected})
+            uow.log_event("category_selected", {"category": selected})
         else:
             msg.body("Please choose a valid number from the list above.")
-        return str(response)
+        return
 
-    if state["stage"] == "choose_scenario":
-        options = user_state[from_number].get("scenario_options", [])
+    if state.stage == "choose_scenario":
+        options = state.scenario_options or []
         try:
             selected_index = int(incoming_msg) - 1
             if 0 <= selected_index < len(options) - 1:
                 scenario = options[selected_index]
 
                 # ✅ Save only in memory, not DB
-                user_state[from_number]["scenario"] = scenario
-                user_state[from_number]["stage"] = "gpt_mode"
+                state.scenario = scenario
+                state.stage = "gpt_mode"
 
-                log_event(
-                    from_number,
+                uow.log_event(
                     "scenario_selected",
-                    {"category": user_state[from_number].get("category"), "scenario": scenario},
+                    {"category": state.category, "scenario": scenario},
                 )
 
                 msg.body(
                     "Thanks for sharing that. I’m here for you 💛 Just tell me a bit more about what’s been going on, and we’ll work through it together."
                 )
             elif selected_index == len(options) - 1:
-                user_state[from_number]["stage"] = "gpt_mode_custom"
+                state.stage = "gpt_mode_custom"
                 msg.body(
                     "No problem — just type out what’s going on and I’ll do my best to help 💬"
                 )
@@ -401,14 +492,14 @@ def bot():
         except Exception as e:
             print("[ERROR in choose_scenario]", str(e))
             msg.body("Please reply with the number of your choice.")
-        return str(response)
+        return
 
-    if state.get("stage") == "assessment" and from_number in user_sessions:
-        session = user_sessions[from_number]
+    if state.stage == "assessment" and state.assessment is not None:
+        session = state.assessment
+        user_sessions = {from_number: session}
         q_index = session["current_q"]  # get current question index BEFORE it's incremented
 
-        log_event(
-            from_number,
+        uow.log_event(
             "assessment_answered",
             {"question": assessment_questions[q_index]["text"], "answer": incoming_msg},
         )
@@ -417,57 +508,54 @@ def bot():
         if next_q:
             msg.body(next_q)
         else:
-            scores = calculate_trait_scores(user_sessions[from_number]["answers"])
+            scores = calculate_trait_scores(session["answers"])
             identity = assign_identity(scores)
             feedback = generate_feedback(scores, identity)
-            log_event(from_number, "assessment_completed", {"scores": scores, "identity": identity})
+            uow.log_event("assessment_completed", {"scores": scores, "identity": identity})
 
             # ✅ Offer next options after feedback
             msg.body(feedback + "\n\nWhat would you like to do next?\n1. Get advice\n2. Restart")
-            del user_sessions[from_number]
+            state.assessment = None
 
             # ✅ Reset stage so they can choose what's next
-            user_state[from_number]["stage"] = "choose_path"
-        return str(response)
+            state.stage = "choose_path"
+        return
 
-    if state["stage"] in ["gpt_mode", "gpt_mode_custom"]:
-        scenario = user_state[from_number].get("scenario", "").strip()
+    if state.stage in ["gpt_mode", "gpt_mode_custom"]:
+        scenario = (state.scenario or "").strip()
         user_input = incoming_msg.strip()
 
-        if state["stage"] == "gpt_mode_custom":
+        if state.stage == "gpt_mode_custom":
             scenario = user_input
 
         if not scenario:
             msg.body("Hmm, I didn’t quite catch that. Can you describe what’s going on again?")
-            return str(response)
+            return
 
         if not user_input:
             msg.body("Could you tell me a bit more about what's happening so I can help?")
-            return str(response)
+            return
 
         # ✅ Check relevance
         if not is_relevant(user_input):
             msg.body(
                 "I'm here for you 💛 Could you share a little more about what’s happening so I can support you better?"
             )
-            return str(response)
+            return
 
         # ✅ Initialize conversation step if not already set
-        if "current_step" not in user_state[from_number]:
-            user_state[from_number]["current_step"] = "validation_exploration"
-        if "free_chat_mode" not in user_state[from_number]:
-            user_state[from_number]["free_chat_mode"] = False
+        if state.current_step is None:
+            state.current_step = "validation_exploration"
 
-        current_step = user_state[from_number]["current_step"]
-        free_chat_mode = user_state[from_number]["free_chat_mode"]
+        current_step = state.current_step
+        free_chat_mode = state.free_chat_mode
 
         # ✅ Intent detection (from helpers)
         intent = detect_intent(user_input)
-        log_event(
-            from_number,
+        uow.log_event(
             "gpt_step",
             {
-                "step": user_state[from_number]["current_step"],
+                "step": state.current_step,
                 "intent": intent,
                 "input": user_input,
             },
@@ -475,63 +563,152 @@ def bot():
 
         if not free_chat_mode:
             if intent == "wants_message_help":
-                user_state[from_number]["current_step"] = "drafting_message"
+                state.current_step = "drafting_message"
             elif intent == "wants_advice" and current_step not in [
                 "psychoeducation",
                 "empowerment",
                 "drafting_message",
                 "closing",
             ]:
-                user_state[from_number]["current_step"] = "psychoeducation"
+                state.current_step = "psychoeducation"
             elif intent == "emotional_venting" and current_step != "validation_exploration":
-                user_state[from_number]["current_step"] = "validation_exploration"
+                state.current_step = "validation_exploration"
 
         # ✅ After message help or drafting, move to free chat
-        if user_state[from_number]["current_step"] in [
+        if state.current_step in [
             "offer_message_help",
             "drafting_message",
             "closing",
         ]:
-            user_state[from_number]["free_chat_mode"] = True
+            state.free_chat_mode = True
             free_chat_mode = True
 
-        # ✅ Build prompt based on the current step
+        # ✅ Build prompt based on the current step, after the earlier turns (memory)
         prompt = generate_prompt(current_step, scenario, user_input)
-
-        try:
-            gpt_response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": ALLYAI_SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.7,
-            )
-            reply = gpt_response.choices[0].message.content.strip()
-            msg.body(reply)
-            log_event(from_number, "gpt_reply_sent", {"step": current_step, "reply": reply})
-
-            # ✅ After GPT reply, move to next step
-            update_user_step(user_state, from_number)
-
-        except Exception as e:
-            print("[ERROR in GPT fallback]", str(e))
-            msg.body(
-                "Something went wrong while generating a response. Please try again or type 'restart' to start over."
-            )
+        messages = build_gpt_messages(prompt, state.memory)
+        remember(state, USER + user_input)
 
         # ✅ Launch guardrail check in background
-        history = user_state[from_number].get("history", [])
-        history.append(f"User: {user_input}")
-        user_state[from_number]["history"] = history
-
-        launch_guardrail_check(from_number, history, user_input)
-
-        return str(response)
+        # (history is a bounded ring buffer; the guardrail gets a snapshot)
+        state.history.append(f"User: {user_input}")
+
+        launch_guardrail_check(from_number, list(state.history), user_input)
+
+        # ✅ The completion itself is run by the caller (inline, deferred or awaited).
+        # Only first turns of built-in scenarios are cacheable (no earlier context to miss)
+        cacheable = state.stage == "gpt_mode" and len(state.history) == 1
+        return GptTurn(
+            current_step,
+            prompt,
+            scenario,
+            user_input,
+            cacheable,
+            messages,
+            memory_count(state.memory),
+        )
 
     # default
     msg.body("Let’s start over — type 'restart'.")
-    return str(response)
+    return
+
+
+# -------- GPT turns -------- #
+class GptTurn(NamedTuple):
+    """A gpt_mode message that still needs its completion: the step it was built for and the prompt."""
+
+    step: str
+    prompt: str
+    scenario: str = ""
+    user_input: str = ""
+    cacheable: bool = False
+    messages: tuple = ()  # full chat request: system prompt, memory, step prompt
+    memory_seq: int = 0  # sequence number of the user's turn in the memory
+
+
+def cached_gpt_reply(turn):
+    """A cached reply for this turn, or None."""
+    if not turn.cacheable:
+        return None
+    return response_cache.get(turn.step, turn.scenario, turn.user_input)
+
+
+def remember_gpt_reply(turn, reply):
+    if turn.cacheable:
+        response_cache.put(turn.step, turn.scenario, turn.user_input, reply)
+
+
+def build_gpt_messages(prompt, memory=None):
+    """Chat messages for a step prompt, with earlier turns from the state's `memory`."""
+    return build_messages(ALLYAI_SYSTEM_PROMPT, prompt, memory)
+
+
+def complete_gpt_reply(turn):
+    """Run the chat completion for a GPT turn (model routed by step) and return the reply text."""
+    return llm.complete(client, turn.step, list(turn.messages) or build_gpt_messages(turn.prompt))
+
+
+def run_gpt_turn(from_number, turn, msg, uow, state):
+    """Complete a GPT turn on the request thread, or hand it to the dispatcher in deferred mode."""
+    reply = cached_gpt_reply(turn)
+    if reply is not None:
+        apply_gpt_reply(turn, reply, msg, uow, state, cached=True)
+        return
+
+    if DEFERRED_REPLIES:
+        # ✅ Reply is generated on the worker pool and sent via Twilio; advance now
+        state.current_step = next_step(state.current_step)
+        reply_dispatcher.submit(from_number, lambda: deferred_gpt_reply(from_number, turn))
+        return
+
+    try:
+        reply = complete_gpt_reply(turn)
+    except Exception as e:
+        print("[ERROR in GPT fallback]", str(e))
+        msg.body(GPT_ERROR_REPLY)
+        return
+    remember_gpt_reply(turn, reply)
+    apply_gpt_reply(turn, reply, msg, uow, state)
+
+
+def apply_gpt_reply(turn, reply, msg, uow, state, cached=False):
+    msg.body(reply)
+    uow.log_event("gpt_reply_sent", {"step": turn.step, "reply": reply, "cached": cached})
+    remember(state, ASSISTANT + reply)
+
+    # ✅ After GPT reply, move to next step
+    state.current_step = next_step(state.current_step)
+
+
+def deferred_gpt_reply(from_number, turn):
+    """Worker-side half of a deferred turn: returns the text the dispatcher sends."""
+    try:
+        reply = complete_gpt_reply(turn)
+    except Exception as e:
+        print("[ERROR in GPT fallback]", str(e))
+        return GPT_ERROR_REPLY
+    remember_gpt_reply(turn, reply)
+    log_event(from_number, "gpt_reply_sent", {"step": turn.step, "reply": reply})
+    remember_deferred_reply(from_number, reply, turn.memory_seq)
+    return reply
+
+
+def remember_deferred_reply(from_number, reply, reply_to=None, attempts=3):
+    """
+    Add a reply produced after the request finished to the user's stored memory.
+    If the request hasn't saved the turn it answers yet, its save merges the two
+    (merge_concurrent_memory) and puts the reply after that turn.
+    """
+    for _ in range(attempts):
+        state, version, _ = load_conversation(from_number)
+        if state.memory is None:
+            return  # the conversation was restarted meanwhile
+        remember(state, ASSISTANT + reply, reply_to=reply_to)
+        try:
+            STATE_STORE.put(from_number, state.to_dict(), version)
+            return
+        except StateConflict:
+            continue  # a message from the user was saved meanwhile; re-read and retry
+    print(f"[State] Could not remember a deferred reply for {from_number}")
 
 
 if __name__ == "__main__":
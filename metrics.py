@@ -0,0 +1,78 @@
+# metrics.py
+# Small in-process metrics: labeled histograms with fixed buckets. Cheap enough
+# to record on every request; snapshot() gives counts, sums and rough
+# percentiles per label set so routing tables and budgets can be tuned from
+# production data.
+
+import bisect
+import threading
+from typing import Dict, Sequence, Tuple
+
+# Seconds; covers cache hits (ms) through slow completions (tens of seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+REGISTRY = []  # every Histogram created, in creation order
+
+
+class Histogram:
+    """Thread-safe histogram family: one set of bucket counts per label combination."""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels -> [bucket counts..., +Inf, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self) -> Dict[Tuple[str, ...], dict]:
+        """Per label set: count, sum, cumulative bucket counts and p50/p90/p99 estimates."""
+        with self._lock:
+            raw = {key: list(series) for key, series in self._series.items()}
+        out = {}
+        for key, series in raw.items():
+            counts, total = series[:-1], series[-1]
+            cumulative, running = [], 0
+            for c in counts:
+                running += c
+                cumulative.append(running)
+            out[key] = {
+                "count": running,
+                "sum": total,
+                "buckets": dict(zip(self.buckets + (float("inf"),), cumulative)),
+                "p50": self._quantile(cumulative, 0.5),
+                "p90": self._quantile(cumulative, 0.9),
+                "p99": self._quantile(cumulative, 0.99),
+            }
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def _quantile(self, cumulative, q):
+        """Upper bound of the bucket holding the q-th observation."""
+        if not cumulative or not cumulative[-1]:
+            return 0.0
+        rank = q * cumulative[-1]
+        for bound, count in zip(self.buckets + (float("inf"),), cumulative):
+            if count >= rank:
+                return bound
+        return float("inf")
@@ -0,0 +1,258 @@
+# outbound.py
+# Outbound WhatsApp messages through the Twilio REST API, outside the webhook
+# response (crisis notices, deferred GPT replies). One aiohttp session with a
+# bounded connection pool runs on a dedicated event loop thread, so async
+# callers (the guardrail loop) and sync callers (reply workers) share it.
+# Sends go through a token bucket matching the sender's throughput, transient
+# failures (429 / 5xx / network) are retried with jittered exponential backoff,
+# and a per-user cooldown suppresses repeats of the same notice in a burst.
+
+import os
+import time
+import atexit
+import base64
+import random
+import asyncio
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from typing import Optional
+
+import aiohttp
+
+# -------- Config (env) -------- #
+TWILIO_SID = os.getenv("TWILIO_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+TWILIO_NUMBER = os.getenv(
+    "TWILIO_NUMBER", "whatsapp:+14155238886"
+)  # replace with your Twilio number
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com")
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "80"))  # msgs/sec (WhatsApp sender default)
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", "80"))
+OUTBOUND_MAX_CONNECTIONS = int(os.getenv("OUTBOUND_MAX_CONNECTIONS", "20"))
+OUTBOUND_RETRIES = int(os.getenv("OUTBOUND_RETRIES", "3"))
+OUTBOUND_BACKOFF = float(os.getenv("OUTBOUND_BACKOFF", "0.5"))  # seconds, doubled per retry
+OUTBOUND_TIMEOUT = float(os.getenv("OUTBOUND_TIMEOUT", "10"))  # seconds per request
+OUTBOUND_MAX_RETRY_AFTER = float(os.getenv("OUTBOUND_MAX_RETRY_AFTER", "5"))  # seconds
+OUTBOUND_SEND_TIMEOUT = float(os.getenv("OUTBOUND_SEND_TIMEOUT", "30"))  # send_sync wait, seconds
+OUTBOUND_DEDUP_MAX = int(os.getenv("OUTBOUND_DEDUP_MAX", "100000"))  # cooldown entries kept
+
+SENT, SUPPRESSED, FAILED = "sent", "suppressed", "failed"
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens/sec, up to `burst` at once. Single event loop only."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> float:
+        """Take one token, sleeping until one is available. Returns the time waited."""
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return waited
+            delay = (1 - self._tokens) / self.rate
+            waited += delay
+            await asyncio.sleep(delay)
+
+
+class OutboundSender:
+    """
+    `await send(...)` from any event loop, or `send_sync(...)` from any thread.
+    Both return SENT, SUPPRESSED (cooldown still running) or FAILED.
+    """
+
+    def __init__(
+        self,
+        account_sid: Optional[str] = TWILIO_SID,
+        auth_token: Optional[str] = TWILIO_AUTH_TOKEN,
+        from_number: str = TWILIO_NUMBER,
+        base_url: str = TWILIO_API_BASE,
+        rate: float = OUTBOUND_RATE,
+        burst: int = OUTBOUND_BURST,
+        max_connections: int = OUTBOUND_MAX_CONNECTIONS,
+        retries: int = OUTBOUND_RETRIES,
+        backoff: float = OUTBOUND_BACKOFF,
+        timeout: float = OUTBOUND_TIMEOUT,
+        max_retry_after: float = OUTBOUND_MAX_RETRY_AFTER,
+        send_timeout: float = OUTBOUND_SEND_TIMEOUT,
+    ):
+        self.from_number = from_number
+        self.url = f"{base_url.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        credentials = f"{account_sid or ''}:{auth_token or ''}".encode()
+        self._headers = {"Authorization": "Basic " + base64.b64encode(credentials).decode()}
+        self._bucket = TokenBucket(rate, burst)
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_retry_after = max_retry_after
+        self.send_timeout = send_timeout
+        self._cooldowns = OrderedDict()  # (to, dedup_key) -> expires_at; loop thread only
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._counters = {"sent": 0, "failed": 0, "retried": 0, "suppressed": 0}
+        self._throttled_s = 0.0
+
+    # -------- Public API -------- #
+    async def send(self, to, body, dedup_key=None, cooldown=0.0) -> str:
+        self._ensure_started()
+        coro = self._send(to, body, dedup_key, cooldown)
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+
+    def send_sync(self, to, body, dedup_key=None, cooldown=0.0) -> str:
+        """Send and wait at most `send_timeout`; a send still running then is cancelled."""
+        self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(
+            self._send(to, body, dedup_key, cooldown), self._loop
+        )
+        try:
+            return future.result(timeout=self.send_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            print(f"[Outbound Error] Message to {to} timed out after {self.send_timeout}s")
+            self._count("failed")
+            return FAILED
+
+    def close(self) -> None:
+        """Close the HTTP session and stop the loop thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_session(), self._loop).result(timeout=5)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            thread.join(timeout=1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+            out["throttled_s"] = self._throttled_s
+        return out
+
+    # -------- Loop thread -------- #
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            started = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, args=(started,), name="outbound", daemon=True
+            )
+            self._thread.start()
+            started.wait()
+
+    def _run(self, started):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(started.set)
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                headers=self._headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _claim_cooldown(self, key, cooldown) -> bool:
+        """Reserve the cooldown window for `key`; False if one is still running."""
+        now = time.monotonic()
+        expires = self._cooldowns.get(key)
+        if expires is not None and expires > now:
+            return False
+        self._cooldowns[key] = now + cooldown
+        self._cooldowns.move_to_end(key)
+        while self._cooldowns and (
+            len(self._cooldowns) > OUTBOUND_DEDUP_MAX or next(iter(self._cooldowns.values())) <= now
+        ):
+            self._cooldowns.popitem(last=False)
+        return True
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    async def _send(self, to, body, dedup_key, cooldown) -> str:
+        key = (to, dedup_key)
+        if dedup_key is not None and cooldown > 0 and not self._claim_cooldown(key, cooldown):
+            self._count("suppressed")
+            return SUPPRESSED
+        result = FAILED  # also when cancelled (send_sync gave up waiting)
+        try:
+            result = await self._deliver(to, body)
+        finally:
+            if result == FAILED and dedup_key is not None:
+                self._cooldowns.pop(key, None)  # let a later attempt through
+        return result
+
+    async def _deliver(self, to, body) -> str:
+        data = {"To": to, "From": self.from_number, "Body": body}
+        for attempt in range(self.retries + 1):
+            waited = await self._bucket.acquire()
+            if waited:
+                with self._lock:
+                    self._throttled_s += waited
+            retry_after = None
+            try:
+                async with self._get_session().post(self.url, data=data) as resp:
+                    if resp.status < 300:
+                        self._count("sent")
+                        return SENT
+                    error = f"HTTP {resp.status}: {(await resp.text())[:200]}"
+                    retryable = resp.status == 429 or resp.status >= 500
+                    retry_after = resp.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error, retryable = repr(e), True
+
+            if not retryable or attempt == self.retries:
+                break
+            self._count("retried")
+            delay = self.backoff * (2**attempt) * (0.5 + random.random())
+            if retry_after and retry_after.isdigit():
+                # Honour Retry-After, but never stall a send for longer than the cap
+                delay = max(delay, min(float(retry_after), self.max_retry_after))
+            await asyncio.sleep(delay)
+
+        print(f"[Outbound Error] Message to {to} failed: {error}")
+        self._count("failed")
+        return FAILED
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_outbound_sender():
+    """Return the process-wide sender, creating it on first use."""
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                _sender = OutboundSender()
+                atexit.register(_sender.close)
+    return _sender
@@ -0,0 +1,149 @@
+# prescreen.py
+# Fast local first tier for the safety guardrail. A compiled lexicon of
+# self-harm, violence and distress cues plus a small deterministic scorer decides
+# whether a message needs the LLM classifier:
+#   risk      -> LLM check with priority (explicit crisis cues)
+#   ambiguous -> normal LLM check
+#   safe      -> skip the LLM (a trivial acknowledgement in a cue-free conversation)
+# A lexicon can't catch every paraphrase ("kms", "i have the rope ready"), so only
+# an exact allowlist of acknowledgements is ever skipped; anything else gets the LLM.
+# Tuning must keep every CRISIS example in tests/data/guardrail_corpus.json out of "safe".
+
+import os
+import re
+from typing import Iterable, List, NamedTuple, Tuple
+
+# -------- Config (env) -------- #
+GUARDRAIL_PRESCREEN = os.getenv("GUARDRAIL_PRESCREEN", "1") != "0"
+GUARDRAIL_RISK_SCORE = int(os.getenv("GUARDRAIL_RISK_SCORE", "3"))  # score that means "risk"
+GUARDRAIL_HISTORY_LOOKBACK = int(os.getenv("GUARDRAIL_HISTORY_LOOKBACK", "5"))  # earlier turns
+
+# -------- Lexicon -------- #
+# (weight, pattern). Weight 3 = explicit crisis cue, 1 = distress / risk-adjacent word.
+_ME = r"(?:my ?self|me)"
+_LEXICON: List[Tuple[int, str]] = [
+    # Self-harm / suicide
+    (3, r"\bsuicid(?:e|al)\b"),
+    (3, rf"\bkill(?:ing)? {_ME}\b"),
+    (3, r"\bend(?:ing)? (?:it all|my life|everything|things)\b"),
+    (3, r"\btake my (?:own )?life\b"),
+    (3, r"\bwant(?:ed)? to die\b"),
+    (3, r"\bwanna die\b"),
+    (3, r"\bbetter off dead\b"),
+    (3, r"\bno reason to (?:live|stay)\b"),
+    (3, rf"\b(?:cut|cutting|hurt|hurting|harm|harming|burn|burning) {_ME}\b"),
+    (3, r"\bself[- ]?harm"),
+    (
+        3,
+        r"\b(?:took|take|taking|swallow(?:ed)?) (?:all |a bunch of |some )?(?:the |my )?(?:pills|tablets)\b",
+    ),
+    (3, r"\boverdos(?:e|ed|ing)\b"),
+    (3, r"\bjump(?:ing)? (?:off|in front)\b"),
+    (3, r"\bhang(?:ing)? myself\b"),
+    (3, r"\b(?:do not|don't|dont|not) want to (?:be here|live|wake up|exist)(?: anymore)?\b"),
+    (3, r"\b(?:nobody|no one) would (?:miss|care if)\b"),
+    (3, r"\bwrote (?:a|my) (?:suicide )?note\b"),
+    (3, r"\bgiv(?:e|ing) away (?:all )?my (?:things|stuff|belongings)\b"),
+    (3, r"\b(?:won't|will not|wont) be (?:around|here) (?:much longer|anymore|tomorrow)\b"),
+    (3, r"\b(?:say|saying|said) (?:my )?(?:final )?goodbyes?\b"),
+    # Ongoing violence / endangerment
+    (
+        3,
+        r"\b(?:is|keeps|was|started|he's|she's|they're) (?:hitting|beating|choking|strangling|punching|kicking) me\b",
+    ),
+    (3, r"\b(?:hit|beat|choked|strangled|punched|kicked|slapped|pushed) me\b"),
+    (3, r"\b(?:kill|hurt) me if\b"),
+    (3, r"\b(?:threaten(?:ed|s|ing)?|going) to kill me\b"),
+    (3, r"\b(?:he|she|they)(?:'ll| will|'d| would) kill me\b"),
+    (3, r"\b(?:locked|trapped) me\b"),
+    (3, r"\bforced me\b"),
+    (3, r"\b(?:raped?|sexually assault(?:ed)?)\b"),
+    (3, r"\b(?:has|had|grabbed|holding) a (?:gun|knife)\b"),
+    (3, r"\b(?:afraid|scared) for my life\b"),
+    (3, r"\bin danger\b"),
+    # Distress and risk-adjacent words (never enough for "risk" alone, but never "safe")
+    (1, r"\bhopeless"),
+    (1, r"\bcan'?t (?:cope|go on|take (?:it|this)|do this|breathe|anymore)\b"),
+    (1, r"\bhate (?:myself|my life)\b"),
+    (1, r"\bworthless\b"),
+    (1, r"\bdepress(?:ed|ion)\b"),
+    (1, r"\bpanic"),
+    (1, r"\b(?:scared|afraid|terrified|unsafe)\b"),
+    (1, r"\bgive up\b"),
+    (1, r"\bdisappear"),
+    (1, r"\b(?:i'?m|im) done\b"),
+    (1, r"\btired of (?:living|life|everything|being alive)\b"),
+    (1, r"\bwhat'?s the point\b"),
+    (1, r"\b(?:die|dying|dead|death|kill|suicide|pills|knife|gun|blood|bleeding)\b"),
+    (1, r"\b(?:hurt|hurts|hurting)\b"),
+    (1, r"\b(?:abuse|abusive|violent|threat)"),
+]
+_COMPILED = [(weight, re.compile(pattern)) for weight, pattern in _LEXICON]
+
+# Whole messages (normalized, punctuation stripped) that may skip the LLM check
+_ACKNOWLEDGEMENTS = frozenset(
+    [
+        "ok",
+        "okay",
+        "k",
+        "kk",
+        "ok thanks",
+        "okay thanks",
+        "thanks",
+        "thank you",
+        "thank you so much",
+        "thx",
+        "ty",
+        "yes",
+        "yeah",
+        "yep",
+        "yup",
+        "sure",
+        "cool",
+        "got it",
+        "sounds good",
+        "makes sense",
+        "yeah that makes sense",
+        "hi",
+        "hello",
+        "hey",
+    ]
+)
+_PUNCTUATION = re.compile(r"[^\w\s']")
+
+_APOSTROPHES = str.maketrans({"’": "'", "‘": "'", "`": "'"})
+
+
+class Prescreen(NamedTuple):
+    tier: str  # "risk" | "ambiguous" | "safe"
+    score: int
+    cues: Tuple[str, ...]
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").lower().translate(_APOSTROPHES).split())
+
+
+def score_text(text: str) -> Tuple[int, Tuple[str, ...]]:
+    """Sum cue weights found in `text`; returns (score, matched cue strings)."""
+    norm = _normalize(text)
+    score, cues = 0, []
+    for weight, pattern in _COMPILED:
+        match = pattern.search(norm)
+        if match:
+            score += weight
+            cues.append(match.group(0))
+    return score, tuple(cues)
+
+
+def prescreen(text: str, history: Iterable[str] = ()) -> Prescreen:
+    """Decide how the guardrail should treat `text`, given recent conversation `history`."""
+    score, cues = score_text(text)
+    if score >= GUARDRAIL_RISK_SCORE:
+        return Prescreen("risk", score, cues)
+    if score == 0 and _PUNCTUATION.sub("", _normalize(text)).strip() in _ACKNOWLEDGEMENTS:
+        # An acknowledgement is only safe if the recent conversation is cue-free too
+        recent = list(history)[-GUARDRAIL_HISTORY_LOOKBACK:]
+        if not any(score_text(turn)[0] for turn in recent):
+            return Prescreen("safe", 0, ())
+    return Prescreen("ambiguous", score, cues)
@@ -0,0 +1,108 @@
+# profile_cache.py
+# In-process LRU + TTL cache for user profiles, kept current by write-through
+# from analytics.create_or_update_user. Unknown numbers are cached negatively
+# (for a shorter TTL) so first-contact checks don't hit Postgres every message.
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# -------- Config (env) -------- #
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))  # seconds
+PROFILE_CACHE_NEGATIVE_TTL = float(os.getenv("PROFILE_CACHE_NEGATIVE_TTL", "60"))
+
+# Column defaults from the user_profiles table, used when a write creates the row
+PROFILE_DEFAULTS = {
+    "name": None,
+    "chosen_track": None,
+    "current_day": 0,
+    "points": 0,
+    "streak": 0,
+    "waiting_for_answer": False,
+}
+
+_MISSING = None  # cached value for "no such profile"
+
+
+class ProfileCache:
+    """Thread-safe LRU with per-entry expiry. Values are copied in and out."""
+
+    def __init__(
+        self,
+        maxsize: int = PROFILE_CACHE_SIZE,
+        ttl: float = PROFILE_CACHE_TTL,
+        negative_ttl: float = PROFILE_CACHE_NEGATIVE_TTL,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()  # phone -> (expires_at, profile or None)
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "negative_hits": 0, "evictions": 0}
+
+    def get(self, phone: str) -> Tuple[bool, Optional[dict]]:
+        """Return (hit, profile). A hit with profile None means 'known not to exist'."""
+        with self._lock:
+            entry = self._data.get(phone)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._data[phone]
+                self._counters["misses"] += 1
+                return False, None
+            self._data.move_to_end(phone)
+            profile = entry[1]
+            if profile is _MISSING:
+                self._counters["negative_hits"] += 1
+                return True, None
+            self._counters["hits"] += 1
+            return True, dict(profile)
+
+    def put(self, phone: str, profile: Optional[dict]) -> None:
+        """Cache a loaded profile, or None to remember that the number is unknown."""
+        ttl = self.ttl if profile is not None else self.negative_ttl
+        value = dict(profile) if profile is not None else _MISSING
+        with self._lock:
+            self._store(phone, value, ttl)
+
+    def apply_update(self, phone: str, changes: dict) -> None:
+        """
+        Write-through after a successful upsert. Merges into a cached profile; if the
+        number was cached as unknown, the upsert created the row from column defaults.
+        Uncached numbers are left alone (other columns are unknown).
+        """
+        with self._lock:
+            entry = self._data.get(phone)
+            if entry is None:
+                return
+            if entry[1] is _MISSING:
+                profile = {"phone_number": phone, **PROFILE_DEFAULTS}
+            else:
+                profile = dict(entry[1])
+            profile.update(changes)
+            self._store(phone, profile, self.ttl)
+
+    def invalidate(self, phone: str) -> None:
+        with self._lock:
+            self._data.pop(phone, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+            out["size"] = len(self._data)
+        lookups = out["hits"] + out["negative_hits"] + out["misses"]
+        out["hit_rate"] = (out["hits"] + out["negative_hits"]) / lookups if lookups else 0.0
+        return out
+
+    def _store(self, phone: str, value, ttl: float) -> None:
+        self._data[phone] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(phone)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self._counters["evictions"] += 1
@@ -0,0 +1,63 @@
+# reply_dispatcher.py
+# Out-of-band delivery of slow replies (GPT). The webhook hands a job to the
+# dispatcher and returns immediately; a worker pool runs the job and sends its
+# result through the Twilio REST API. Jobs for the same user run one at a time,
+# in submission order, so replies never overtake each other.
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+REPLY_WORKERS = int(os.getenv("REPLY_WORKERS", "8"))
+
+
+class ReplyDispatcher:
+    """
+    `send(to, body)` delivers a message (e.g. twilio_client.messages.create).
+    `submit(user_id, job)` queues `job()`, whose return value (if any) is sent to the user.
+    """
+
+    def __init__(self, send: Callable[[str, str], None], max_workers: int = REPLY_WORKERS):
+        self._send = send
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reply")
+        self._chains = {}  # user_id -> deque of pending jobs (present while a drain is running)
+        self._lock = threading.Condition()
+
+    def submit(self, user_id: str, job: Callable[[], Optional[str]]) -> None:
+        with self._lock:
+            chain = self._chains.get(user_id)
+            if chain is not None:
+                chain.append(job)  # the running drain for this user will pick it up
+                return
+            self._chains[user_id] = deque([job])
+        self._executor.submit(self._drain, user_id)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until every submitted job has finished. Returns False on timeout."""
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._chains, timeout)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(chain) for chain in self._chains.values())
+
+    def _drain(self, user_id: str) -> None:
+        while True:
+            with self._lock:
+                chain = self._chains[user_id]
+                if not chain:
+                    del self._chains[user_id]
+                    self._lock.notify_all()
+                    return
+                job = chain.popleft()
+            try:
+                body = job()
+                if body:
+                    self._send(user_id, body)
+            except Exception as e:
+                print(f"[Reply Error] Deferred reply to {user_id} failed: {e}")
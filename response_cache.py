@@ -0,0 +1,239 @@
+# response_cache.py
+# LRU + TTL cache of GPT replies for the built-in scenarios, keyed on
+# (step, scenario, normalized user input). Each key holds a small pool of
+# reply variants and a hit returns one at random, so cached openers don't all
+# read the same. Only steps listed in RESPONSE_CACHE_STEPS are cached.
+#
+# Offline warm-up (pre-generates replies for common openers of every scenario):
+#   python response_cache.py warm --variants 3 [--output response_cache.json]
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+# -------- Config (env) -------- #
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+RESPONSE_CACHE_VARIANTS = int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))  # replies kept per key
+# Comma-separated steps that may be answered from cache; empty disables the cache
+RESPONSE_CACHE_STEPS = os.getenv("RESPONSE_CACHE_STEPS", "validation_exploration")
+RESPONSE_CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", "response_cache.json")
+
+# First messages users commonly send right after picking a scenario
+WARM_OPENERS = [
+    "this is exactly what happens to me",
+    "yes that's my situation",
+    "that's me",
+    "this happens all the time",
+    "i don't know what to do",
+    "i feel so confused",
+    "it hurts so much",
+    "i'm tired of this",
+    "i need help with this",
+    "same thing happened to me",
+]
+
+_PUNCT = re.compile(r"[^\w\s]")
+
+
+def normalize_input(text: str) -> str:
+    """Lowercase, drop punctuation/emoji and collapse whitespace."""
+    text = (text or "").lower().replace("’", "'")
+    return " ".join(_PUNCT.sub("", text).split())
+
+
+def parse_steps(spec: str) -> frozenset:
+    return frozenset(step.strip() for step in spec.split(",") if step.strip())
+
+
+class ResponseCache:
+    """Thread-safe LRU of reply pools with per-entry expiry (wall clock, so entries can be saved)."""
+
+    def __init__(
+        self,
+        maxsize: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+        steps: Iterable[str] = parse_steps(RESPONSE_CACHE_STEPS),
+        variants: int = RESPONSE_CACHE_VARIANTS,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.steps = frozenset(steps)
+        self.variants = variants
+        self._data = OrderedDict()  # (step, scenario, input) -> (expires_at, [replies])
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+        self._step_counters = {}  # step -> [hits, misses]
+
+    def enabled_for(self, step: str) -> bool:
+        return step in self.steps
+
+    def get(self, step: str, scenario: str, user_input: str) -> Optional[str]:
+        """A cached reply for this turn, or None (also when the step isn't cached)."""
+        if not self.enabled_for(step):
+            return None
+        key = (step, scenario.strip(), normalize_input(user_input))
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._data[key]
+                self._count(step, hit=False)
+                return None
+            self._data.move_to_end(key)
+            self._count(step, hit=True)
+            return random.choice(entry[1])
+
+    def put(self, step: str, scenario: str, user_input: str, reply: str) -> None:
+        """Add `reply` to the pool for this turn (up to `variants` replies per key)."""
+        if not self.enabled_for(step) or not reply:
+            return
+        key = (step, scenario.strip(), normalize_input(user_input))
+        with self._lock:
+            entry = self._data.get(key)
+            pool = list(entry[1]) if entry is not None and entry[0] > time.time() else []
+            if reply not in pool and len(pool) < self.variants:
+                pool.append(reply)
+            self._store(key, pool, time.time() + self.ttl)
+
+    def pool_size(self, step: str, scenario: str, user_input: str) -> int:
+        key = (step, scenario.strip(), normalize_input(user_input))
+        with self._lock:
+            entry = self._data.get(key)
+            return len(entry[1]) if entry is not None and entry[0] > time.time() else 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+            out["size"] = len(self._data)
+            out["steps"] = {
+                step: {"hits": h, "misses": m, "hit_rate": h / (h + m)}
+                for step, (h, m) in self._step_counters.items()
+            }
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = out["hits"] / lookups if lookups else 0.0
+        return out
+
+    # -------- Persistence (warm-up output) -------- #
+    def save(self, path: str) -> int:
+        now = time.time()
+        with self._lock:
+            entries = [
+                {"step": k[0], "scenario": k[1], "input": k[2], "expires_at": exp, "replies": pool}
+                for k, (exp, pool) in self._data.items()
+                if exp > now
+            ]
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+        return len(entries)
+
+    def load(self, path: str) -> int:
+        """Load saved entries (skipping expired ones and disabled steps); returns the count."""
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+        now, loaded = time.time(), 0
+        with self._lock:
+            for e in entries:
+                if e["expires_at"] <= now or not self.enabled_for(e["step"]):
+                    continue
+                key = (e["step"], e["scenario"], e["input"])
+                self._store(key, list(e["replies"])[: self.variants], e["expires_at"])
+                loaded += 1
+        return loaded
+
+    def _count(self, step, hit):
+        self._counters["hits" if hit else "misses"] += 1
+        counts = self._step_counters.setdefault(step, [0, 0])
+        counts[0 if hit else 1] += 1
+
+    def _store(self, key, pool, expires_at) -> None:
+        self._data[key] = (expires_at, pool)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self._counters["evictions"] += 1
+
+
+# -------- Warm-up CLI -------- #
+def warm(
+    cache,
+    scenarios,
+    complete,
+    openers=WARM_OPENERS,
+    variants=RESPONSE_CACHE_VARIANTS,
+    step="validation_exploration",
+):
+    """Fill `cache` with up to `variants` replies per (scenario, opener). Returns completions made."""
+    from helpers import generate_prompt
+
+    made = 0
+    for scenario in scenarios:
+        for opener in openers:
+            while cache.pool_size(step, scenario, opener) < variants:
+                before = cache.pool_size(step, scenario, opener)
+                cache.put(step, scenario, opener, complete(generate_prompt(step, scenario, opener)))
+                made += 1
+                if cache.pool_size(step, scenario, opener) == before:
+                    break  # duplicate reply; don't loop forever
+    return made
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pre-generate cached replies for built-in scenarios"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm_cmd = sub.add_parser("warm")
+    warm_cmd.add_argument("--variants", type=int, default=RESPONSE_CACHE_VARIANTS)
+    warm_cmd.add_argument("--output", default=RESPONSE_CACHE_FILE)
+    warm_cmd.add_argument("--scenarios", default="scenarios.json")
+    warm_cmd.add_argument("--model", default="gpt-4")
+    args = parser.parse_args(argv)
+
+    from openai import OpenAI
+    from helpers import ALLYAI_SYSTEM_PROMPT
+
+    client = OpenAI()
+
+    def complete(prompt):
+        resp = client.chat.completions.create(
+            model=args.model,
+            messages=[
+                {"role": "system", "content": ALLYAI_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.9,  # a little more variety across the pool
+        )
+        return resp.choices[0].message.content.strip()
+
+    with open(args.scenarios, encoding="utf-8") as f:
+        scenarios = [s["scenario"] for s in json.load(f)]
+
+    cache = ResponseCache(
+        maxsize=max(RESPONSE_CACHE_SIZE, len(scenarios) * len(WARM_OPENERS)),
+        steps={"validation_exploration"},
+        variants=args.variants,
+    )
+    if os.path.exists(args.output):
+        cache.load(args.output)
+    made = warm(cache, scenarios, complete, variants=args.variants)
+    saved = cache.save(args.output)
+    print(f"[Response Cache] {made} completions, {saved} entries saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
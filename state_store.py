@@ -0,0 +1,412 @@
+# state_store.py
+# Conversation state storage shared by all workers. Each user has one record
+# (a ConversationState: stage, scenario choice, assessment progress, bounded
+# history) stored as compact JSON with an integer version for optimistic
+# concurrency: a write only succeeds if the version it read is still current.
+# Idle records are evicted (STATE_IDLE_TTL) so memory and tables stay bounded.
+
+import os
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# Records larger than this are zlib-compressed before storing
+_COMPRESS_OVER = 512
+
+# -------- Config (env) -------- #
+STATE_HISTORY_MAX = int(os.getenv("STATE_HISTORY_MAX", "20"))  # turns kept for the guardrail
+STATE_IDLE_TTL = float(os.getenv("STATE_IDLE_TTL", str(7 * 24 * 3600)))  # drop after N idle seconds
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "50000"))  # in-memory store only
+STATE_PURGE_INTERVAL = float(os.getenv("STATE_PURGE_INTERVAL", "3600"))  # shared stores only
+
+
+class StateConflict(Exception):
+    """Raised when a record changed since it was read (another worker wrote it)."""
+
+    def __init__(self, user_ids):
+        self.user_ids = list(user_ids)
+        super().__init__(f"State changed concurrently for: {', '.join(self.user_ids)}")
+
+
+# -------- Conversation state -------- #
+class ConversationState:
+    """
+    One user's conversation. `stage` is None for a user we haven't seen yet.
+    `history` is a ring buffer of the last STATE_HISTORY_MAX user turns,
+    `memory` is the chat model's context (conversation_memory.py) and
+    `assessment` holds {"current_q": int, "answers": list} while a quiz is running.
+    """
+
+    __slots__ = (
+        "stage",
+        "category",
+        "scenario",
+        "scenario_options",
+        "current_step",
+        "free_chat_mode",
+        "history",
+        "memory",
+        "assessment",
+    )
+
+    def __init__(self, stage: Optional[str] = None):
+        self.stage = stage
+        self.category = None
+        self.scenario = None
+        self.scenario_options = None
+        self.current_step = None
+        self.free_chat_mode = False
+        self.history = deque(maxlen=STATE_HISTORY_MAX)
+        self.memory = None
+        self.assessment = None
+
+    def reset(self, stage: str) -> None:
+        """Start over at `stage`, dropping scenario, step, history, memory and any unfinished quiz."""
+        self.__init__(stage)
+
+    def to_dict(self) -> dict:
+        """Compact form for storage: unset fields are omitted."""
+        out = {}
+        for key in self.__slots__:
+            value = getattr(self, key)
+            if value is None or value is False or (key == "history" and not value):
+                continue
+            out[key] = list(value) if key == "history" else value
+        return out
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "ConversationState":
+        state = cls()
+        for key, value in (data or {}).items():
+            if key == "history":
+                state.history.extend(value)
+            elif key in cls.__slots__:
+                setattr(state, key, value)
+        return state
+
+
+# -------- Serialization -------- #
+def encode_record(record: dict) -> bytes:
+    """Compact JSON, compressed when large. The first byte marks the format."""
+    raw = json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(raw) > _COMPRESS_OVER:
+        return b"z" + zlib.compress(raw)
+    return b"j" + raw
+
+
+def decode_record(data: bytes) -> dict:
+    data = bytes(data)
+    if data[:1] == b"z":
+        return json.loads(zlib.decompress(data[1:]))
+    return json.loads(data[1:])
+
+
+# -------- Interface -------- #
+class StateStore:
+    """
+    Versioned key/value store for conversation records.
+    Version 0 means "no record"; each successful write bumps the version by one.
+    """
+
+    def get(self, user_id: str) -> Tuple[Optional[dict], int]:
+        return self.get_many([user_id]).get(user_id, (None, 0))
+
+    def put(self, user_id: str, record: dict, version: int) -> int:
+        """Write `record` if the stored version is still `version`; returns the new version."""
+        return self.put_many({user_id: (record, version)})[user_id]
+
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, Tuple[dict, int]]:
+        """Fetch several records in one round trip. Missing users are omitted."""
+        raise NotImplementedError
+
+    def put_many(self, items: Dict[str, Tuple[dict, int]]) -> Dict[str, int]:
+        """Write several records atomically; raises StateConflict if any version is stale."""
+        raise NotImplementedError
+
+    def delete(self, user_id: str) -> None:
+        raise NotImplementedError
+
+    def purge_idle(self, max_idle: Optional[float] = None) -> int:
+        """Delete records idle for longer than `max_idle` (default STATE_IDLE_TTL); returns count."""
+        raise NotImplementedError
+
+    _next_purge = 0.0
+
+    def _maybe_purge(self) -> None:
+        # Shared stores purge opportunistically from the write path, at most once per interval.
+        now = time.monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + STATE_PURGE_INTERVAL
+        try:
+            self.purge_idle()
+        except Exception as e:
+            print(f"[State] Idle purge failed: {e}")
+
+
+class MemoryStateStore(StateStore):
+    """
+    Process-local store (single worker / tests). Records are kept encoded, in
+    least-recently-used order, and evicted after `idle_ttl` seconds without
+    access or when more than `max_entries` users are resident.
+    """
+
+    def __init__(self, max_entries: int = STATE_MAX_ENTRIES, idle_ttl: float = STATE_IDLE_TTL):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self._data: "OrderedDict[str, Tuple[bytes, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._evicted = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, user_ids):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            for uid in user_ids:
+                if uid in self._data:
+                    blob, version, _ = self._data.pop(uid)
+                    self._data[uid] = (blob, version, now)  # touch: move to the back
+                    found[uid] = (blob, version, now)
+        return {uid: (decode_record(blob), version) for uid, (blob, version, _) in found.items()}
+
+    def put_many(self, items):
+        encoded = {uid: encode_record(record) for uid, (record, _) in items.items()}
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            stale = [uid for uid, (_, v) in items.items() if self._version(uid) != v]
+            if stale:
+                raise StateConflict(stale)
+            for uid, (_, version) in items.items():
+                self._drop(uid)
+                self._data[uid] = (encoded[uid], version + 1, now)
+                self._bytes += len(encoded[uid])
+            while len(self._data) > self.max_entries:
+                self._drop(next(iter(self._data)))
+                self._evicted += 1
+        return {uid: version + 1 for uid, (_, version) in items.items()}
+
+    def delete(self, user_id):
+        with self._lock:
+            self._drop(user_id)
+
+    def purge_idle(self, max_idle=None):
+        with self._lock:
+            return self._evict_expired(time.monotonic(), max_idle)
+
+    def stats(self) -> dict:
+        """Resident sessions and the bytes their encoded records occupy."""
+        with self._lock:
+            return {"sessions": len(self._data), "bytes": self._bytes, "evicted": self._evicted}
+
+    def _evict_expired(self, now: float, max_idle=None) -> int:
+        # Entries are in last-access order, so expired ones sit at the front.
+        cutoff = now - (self.idle_ttl if max_idle is None else max_idle)
+        removed = 0
+        while self._data:
+            uid, (_, _, accessed_at) = next(iter(self._data.items()))
+            if accessed_at > cutoff:
+                break
+            self._drop(uid)
+            removed += 1
+        self._evicted += removed
+        return removed
+
+    def _version(self, user_id: str) -> int:
+        entry = self._data.get(user_id)
+        return entry[1] if entry is not None else 0
+
+    def _drop(self, user_id: str) -> None:
+        entry = self._data.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Shared store in a SQLite file in WAL mode, so all gunicorn workers on a host
+    see the same state. One connection per thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_state (
+                user_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        rows = self._conn().execute(
+            "SELECT user_id, data, version FROM conversation_state WHERE user_id IN "
+            f"({','.join('?' * len(user_ids))})",
+            user_ids,
+        )
+        return {uid: (decode_record(data), version) for uid, data, version in rows}
+
+    def put_many(self, items):
+        conn = self._conn()
+        now = time.time()
+        stale = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for uid, (record, version) in items.items():
+                data = encode_record(record)
+                if version == 0:
+                    cur = conn.execute(
+                        "INSERT INTO conversation_state (user_id, version, data, updated_at) "
+                        "VALUES (?, 1, ?, ?) ON CONFLICT (user_id) DO NOTHING",
+                        (uid, data, now),
+                    )
+                else:
+                    cur = conn.execute(
+                        "UPDATE conversation_state SET version = version + 1, data = ?, updated_at = ? "
+                        "WHERE user_id = ? AND version = ?",
+                        (data, now, uid, version),
+                    )
+                if cur.rowcount != 1:
+                    stale.append(uid)
+            if stale:
+                raise StateConflict(stale)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        self._maybe_purge()
+        return {uid: version + 1 for uid, (_, version) in items.items()}
+
+    def delete(self, user_id):
+        self._conn().execute("DELETE FROM conversation_state WHERE user_id = ?", (user_id,))
+
+    def purge_idle(self, max_idle=None):
+        cutoff = time.time() - (STATE_IDLE_TTL if max_idle is None else max_idle)
+        cur = self._conn().execute("DELETE FROM conversation_state WHERE updated_at < ?", (cutoff,))
+        return cur.rowcount
+
+
+class PostgresStateStore(StateStore):
+    """
+    Shared store in the app's Postgres database, for workers on several hosts.
+    `connection` is a context-manager factory such as analytics.pooled_connection.
+    """
+
+    def __init__(self, connection: Callable):
+        self._connection = connection
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS conversation_state (
+                    user_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    data BYTEA NOT NULL,
+                    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.commit()
+            cur.close()
+
+    def get_many(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT user_id, data, version FROM conversation_state WHERE user_id = ANY(%s)",
+                (user_ids,),
+            )
+            rows = cur.fetchall()
+            cur.close()
+        return {uid: (decode_record(data), version) for uid, data, version in rows}
+
+    def put_many(self, items):
+        stale = []
+        with self._connection() as conn:
+            cur = conn.cursor()
+            for uid, (record, version) in items.items():
+                data = encode_record(record)
+                if version == 0:
+                    cur.execute(
+                        "INSERT INTO conversation_state (user_id, version, data) VALUES (%s, 1, %s) "
+                        "ON CONFLICT (user_id) DO NOTHING",
+                        (uid, data),
+                    )
+                else:
+                    cur.execute(
+                        "UPDATE conversation_state SET version = version + 1, data = %s, "
+                        "updated_at = CURRENT_TIMESTAMP WHERE user_id = %s AND version = %s",
+                        (data, uid, version),
+                    )
+                if cur.rowcount != 1:
+                    stale.append(uid)
+            if stale:
+                conn.rollback()
+                cur.close()
+                raise StateConflict(stale)
+            conn.commit()
+            cur.close()
+        self._maybe_purge()
+        return {uid: version + 1 for uid, (_, version) in items.items()}
+
+    def delete(self, user_id):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM conversation_state WHERE user_id = %s", (user_id,))
+            conn.commit()
+            cur.close()
+
+    def purge_idle(self, max_idle=None):
+        max_idle = STATE_IDLE_TTL if max_idle is None else max_idle
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "DELETE FROM conversation_state "
+                "WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                (max_idle,),
+            )
+            removed = cur.rowcount
+            conn.commit()
+            cur.close()
+        return removed
+
+
+# -------- Factory -------- #
+def create_state_store(spec: Optional[str] = None) -> StateStore:
+    """
+    Build a store from STATE_STORE: "memory" (default), "sqlite:///path/to/state.db"
+    or "postgres" (uses DATABASE_URL through the analytics connection pool).
+    """
+    spec = spec or os.getenv("STATE_STORE", "memory")
+    if spec == "memory":
+        return MemoryStateStore()
+    if spec.startswith("sqlite:///"):
+        return SQLiteStateStore(spec[len("sqlite:///") :])
+    if spec == "postgres":
+        from analytics import pooled_connection
+
+        return PostgresStateStore(pooled_connection)
+    raise ValueError(f"Unknown STATE_STORE: {spec!r}")
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+
+
+class FakeTwilioServer:
+    """Local stand-in for the Twilio Messages API; records every POST it receives."""
+
+    def __init__(self):
+        self.requests = []  # (path, form dict, Authorization header)
+        self.statuses = []  # queued response codes; 201 once empty
+        self.retry_after = "0"  # Retry-After sent with a 429
+        self.delay = 0.0  # seconds before each response
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = dict(parse_qsl(self.rfile.read(length).decode()))
+                with server.lock:
+                    server.requests.append((self.path, form, self.headers.get("Authorization")))
+                    status = server.statuses.pop(0) if server.statuses else 201
+                time.sleep(server.delay)
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    if status == 429:
+                        self.send_header("Retry-After", server.retry_after)
+                    self.end_headers()
+                    self.wfile.write(
+                        b'{"sid": "SM123"}' if status < 300 else b'{"message": "error"}'
+                    )
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up waiting
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def sent(self):
+        with self.lock:
+            return [(form["To"], form["Body"]) for _, form, _ in self.requests]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def fake_twilio():
+    server = FakeTwilioServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def outbound_sender(fake_twilio, monkeypatch):
+    """Process-wide outbound sender pointed at the fake Twilio endpoint."""
+    import outbound
+
+    sender = outbound.OutboundSender("ACtest", "secret", base_url=fake_twilio.url, backoff=0.01)
+    monkeypatch.setattr(outbound, "_sender", sender)
+    yield sender
+    sender.close()
@@ -0,0 +1,178 @@
+import os
+import sys
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+
+import analytics
+from profile_cache import ProfileCache
+
+COLUMNS = (
+    "phone_number",
+    "name",
+    "chosen_track",
+    "current_day",
+    "points",
+    "streak",
+    "waiting_for_answer",
+)
+
+
+class FakeDB:
+    """Records statements and serves user_profiles rows from a dict (upserts update it)."""
+
+    def __init__(self):
+        self.rows = {}
+        self.statements = []
+        self.fail = False
+        self.connection = self  # psycopg2.extras.execute_values reads cur.connection.encoding
+        self.encoding = "UTF8"
+
+    @contextmanager
+    def borrow(self):
+        yield self
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        if self.fail:
+            raise RuntimeError("db down")
+        self.statements.append(sql)
+        self._last = params
+        if "INSERT INTO user_profiles" in sql:
+            columns = sql.split("(", 1)[1].split(")", 1)[0].split(", ")
+            row = dict(
+                zip(COLUMNS, self.rows.get(params[0], (params[0], None, None, 0, 0, 0, False)))
+            )
+            row.update(zip(columns, params))
+            self.rows[params[0]] = tuple(row[c] for c in COLUMNS)
+
+    def mogrify(self, template, args):
+        return repr(args).encode()
+
+    def fetchone(self):
+        return self.rows.get(self._last[0])
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(analytics, "pooled_connection", fake.borrow)
+    monkeypatch.setattr(analytics, "profile_cache", ProfileCache())
+    monkeypatch.setattr(analytics, "PROFILE_CACHE_ENABLED", True)
+    return fake
+
+
+def test_profile_reads_are_cached(db):
+    db.rows["+1"] = ("+1", "Ana", None, 0, 0, 0, False)
+    assert analytics.get_user_profile("+1")["name"] == "Ana"
+    assert analytics.get_user_profile("+1")["name"] == "Ana"
+    assert len(db.statements) == 1
+    assert analytics.profile_cache_stats()["hits"] == 1
+
+
+def test_unknown_numbers_are_negatively_cached(db):
+    assert analytics.get_user_profile("+2") is None
+    assert analytics.get_user_profile("+2") is None
+    assert len(db.statements) == 1
+
+
+def test_updates_write_through(db):
+    assert analytics.get_user_profile("+3") is None  # cached as unknown
+    analytics.create_or_update_user("+3", name="Bea")
+    analytics.create_or_update_user("+3", chosen_track="Building Confidence", current_day=1)
+
+    profile = analytics.get_user_profile("+3")
+    assert profile["name"] == "Bea"
+    assert profile["chosen_track"] == "Building Confidence"
+    assert profile["points"] == 0
+    assert len(db.statements) == 3  # one SELECT, two upserts, no re-read
+
+
+def test_failed_update_invalidates(db):
+    db.rows["+4"] = ("+4", "Cy", None, 0, 0, 0, False)
+    analytics.get_user_profile("+4")
+    db.fail = True
+    analytics.create_or_update_user("+4", name="Other")
+    db.fail = False
+
+    assert analytics.get_user_profile("+4")["name"] == "Cy"
+    assert len(db.statements) == 2
+
+
+def test_workers_sharing_state_see_each_others_progress(db, monkeypatch):
+    # STATE_STORE=postgres: consecutive messages from one user hit different workers
+    monkeypatch.setattr(analytics, "PROFILE_CACHE_ENABLED", False)
+    worker_a, worker_b = ProfileCache(), ProfileCache()
+    analytics.create_or_update_user("+7", chosen_track="Building Confidence", points=10)
+
+    monkeypatch.setattr(analytics, "profile_cache", worker_b)
+    assert analytics.get_user_profile("+7")["points"] == 10
+
+    monkeypatch.setattr(analytics, "profile_cache", worker_a)
+    profile = analytics.get_user_profile("+7")
+    analytics.create_or_update_user(
+        "+7", current_day=profile["current_day"] + 1, points=profile["points"] + 10
+    )
+
+    monkeypatch.setattr(analytics, "profile_cache", worker_b)
+    profile = analytics.get_user_profile("+7")
+    assert (profile["current_day"], profile["points"]) == (1, 20)
+
+
+def test_cached_profiles_are_copies(db):
+    db.rows["+5"] = ("+5", "Di", None, 0, 0, 0, False)
+    analytics.get_user_profile("+5")["name"] = "mutated"
+    assert analytics.get_user_profile("+5")["name"] == "Di"
+
+
+def test_cache_lru_and_ttl():
+    cache = ProfileCache(maxsize=2, ttl=60, negative_ttl=0)
+    cache.put("a", {"name": "A"})
+    cache.put("b", {"name": "B"})
+    cache.get("a")
+    cache.put("c", {"name": "C"})  # evicts b (least recently used)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a")[0] and cache.get("c")[0]
+
+    cache.put("d", None)  # negative entry with zero TTL expires immediately
+    assert cache.get("d") == (False, None)
+
+
+def test_unit_of_work_reads_once_and_writes_once(db, monkeypatch):
+    queued = []
+    monkeypatch.setattr(analytics, "_enqueue_event", queued.append)
+    db.rows["+6"] = ("+6", "Eve", "Building Confidence", 1, 0, 0, False)
+
+    uow = analytics.UserUnitOfWork("+6")
+    assert uow.profile["current_day"] == 1
+    uow.log_event("message_received", {"input": "A"})
+    uow.update(current_day=2, points=10)
+    assert uow.profile["current_day"] == 2 and uow.profile["name"] == "Eve"
+    uow.commit()
+
+    # One SELECT, then one transaction holding the upsert and the event insert
+    assert len(db.statements) == 3
+    assert "INSERT INTO user_profiles" in db.statements[1]
+    assert "usage_events" in str(db.statements[2])
+    assert queued == []
+    assert analytics.get_user_profile("+6")["points"] == 10
+
+
+def test_unit_of_work_without_changes_queues_events(db, monkeypatch):
+    queued = []
+    monkeypatch.setattr(analytics, "_enqueue_event", queued.append)
+    uow = analytics.UserUnitOfWork("+7")
+    uow.log_event("category_selected", {"category": "Family Tensions"})
+    uow.commit()
+    assert db.statements == []
+    assert [row[1] for row in queued] == ["category_selected"]
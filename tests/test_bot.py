@@ -3,16 +3,23 @@ import sys
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+from types import SimpleNamespace
+
 import pytest
+import analytics
 import main
+from response_cache import ResponseCache
 
 
 @pytest.fixture(autouse=True)
 def stub_db(monkeypatch):
     # Make DB calls no-ops for CI
+    monkeypatch.setattr(analytics, "log_event", lambda *a, **k: None)
+    monkeypatch.setattr(analytics, "_enqueue_event", lambda *a, **k: None)
+    monkeypatch.setattr(analytics, "save_user_changes", lambda *a, **k: None)
+    monkeypatch.setattr(analytics, "get_user_profile", lambda *a, **k: {})
     monkeypatch.setattr(main, "log_event", lambda *a, **k: None)
-    monkeypatch.setattr(main, "create_or_update_user", lambda *a, **k: None)
-    monkeypatch.setattr(main, "get_user_profile", lambda *a, **k: {})
+    monkeypatch.setattr(main, "response_cache", ResponseCache())  # no replies shared between tests
 
 
 @pytest.fixture
@@ -38,3 +45,113 @@ def test_new_user_intro_prompts_for_name(client):
     resp = client.post("/bot", data={"From": "+10000000001", "Body": "Hi"})
     assert resp.status_code == 200
     assert b"your name" in resp.data
+
+
+def test_state_persists_between_messages(client):
+    client.post("/bot", data={"From": "+10000000002", "Body": "Hi"})
+    resp = client.post("/bot", data={"From": "+10000000002", "Body": "ana"})
+    assert b"Nice to meet you, Ana" in resp.data
+    resp = client.post("/bot", data={"From": "+10000000002", "Body": "1"})
+    assert b"Choose a topic" in resp.data
+    assert main.STATE_STORE.get("+10000000002")[0]["stage"] == "choose_category"
+
+
+class FakeOpenAI:
+    """Returns canned completions; `replies` are consumed in order."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        content = self.replies.pop(0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def start_gpt_mode(client, number):
+    client.post("/bot", data={"From": number, "Body": "Hi"})
+    client.post("/bot", data={"From": number, "Body": "ana"})
+    client.post("/bot", data={"From": number, "Body": "1"})
+    client.post("/bot", data={"From": number, "Body": "1"})
+    return client.post("/bot", data={"From": number, "Body": "1"})
+
+
+def test_deferred_reply_is_sent_out_of_band(client, monkeypatch, fake_twilio, outbound_sender):
+    monkeypatch.setattr(main, "client", FakeOpenAI(["first reply", "second reply"]))
+    monkeypatch.setattr(main, "launch_guardrail_check", lambda *a, **k: None)
+    monkeypatch.setattr(main, "DEFERRED_REPLIES", True)
+
+    number = "+10000000003"
+    assert b"tell me a bit more" in start_gpt_mode(client, number).data
+    resp = client.post("/bot", data={"From": number, "Body": "He ignores my texts for days"})
+    assert b"<Message" not in resp.data
+    client.post("/bot", data={"From": number, "Body": "And then acts like nothing happened"})
+
+    assert main.reply_dispatcher.wait_idle(timeout=5)
+    assert fake_twilio.sent() == [(number, "first reply"), (number, "second reply")]
+    assert main.STATE_STORE.get(number)[0]["current_step"] == "empowerment"
+
+
+def test_first_turn_is_answered_from_cache(client, monkeypatch):
+    fake = FakeOpenAI(["live reply", "second turn reply"])
+    monkeypatch.setattr(main, "client", fake)
+    monkeypatch.setattr(main, "launch_guardrail_check", lambda *a, **k: None)
+    cache = ResponseCache(steps={"validation_exploration"})
+    monkeypatch.setattr(main, "response_cache", cache)
+
+    start_gpt_mode(client, "+10000000004")
+    scenario = main.STATE_STORE.get("+10000000004")[0]["scenario"]
+    cache.put("validation_exploration", scenario, "that's me", "cached reply")
+
+    resp = client.post("/bot", data={"From": "+10000000004", "Body": "That’s me!!"})
+    assert b"cached reply" in resp.data
+    assert fake.replies == ["live reply", "second turn reply"]  # no completion
+    assert main.STATE_STORE.get("+10000000004")[0]["current_step"] == "psychoeducation"
+
+    # Later turns always go to the model
+    resp = client.post("/bot", data={"From": "+10000000004", "Body": "that's me"})
+    assert b"live reply" in resp.data
+    assert cache.stats()["hits"] == 1
+
+
+def test_gpt_sees_earlier_turns(client, monkeypatch):
+    fake = FakeOpenAI(["How long has this been going on?", "That must be exhausting."])
+    calls = []
+    create = fake.create
+    fake.create = lambda **kwargs: calls.append(kwargs["messages"]) or create(**kwargs)
+    monkeypatch.setattr(main, "client", fake)
+    monkeypatch.setattr(main, "launch_guardrail_check", lambda *a, **k: None)
+
+    number = "+10000000005"
+    start_gpt_mode(client, number)
+    client.post("/bot", data={"From": number, "Body": "He ignores my texts for days"})
+    client.post("/bot", data={"From": number, "Body": "About two months now"})
+
+    assert len(calls[0]) == 2  # system prompt + step prompt
+    assert calls[1][1:3] == [
+        {"role": "user", "content": "He ignores my texts for days"},
+        {"role": "assistant", "content": "How long has this been going on?"},
+    ]
+    assert "About two months now" in calls[1][-1]["content"]
+
+
+@pytest.mark.parametrize("reply_saved_first", [True, False])
+def test_deferred_reply_lands_after_its_turn(reply_saved_first):
+    number = "+1000000003" + str(int(reply_saved_first))
+    state = main.ConversationState("gpt_mode")
+    main.remember(state, main.USER + "X")
+    main.STATE_STORE.put(number, state.to_dict(), 0)
+
+    state, version, before = main.load_conversation(number)
+    main.remember(state, main.USER + "X")  # the same message again
+    seq = main.memory_count(state.memory)
+    if reply_saved_first:
+        main.remember_deferred_reply(number, "reply", seq)
+        main.save_conversation(number, state, version, before)
+    else:
+        main.save_conversation(number, state, version, before)
+        main.remember_deferred_reply(number, "reply", seq)
+
+    turns = main.STATE_STORE.get(number)[0]["memory"]["turns"]
+    assert turns == [main.USER + "X", main.USER + "X", main.ASSISTANT + "reply"]
@@ -0,0 +1,94 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+import analytics
+import asgi
+import main
+from response_cache import ResponseCache
+
+
+@pytest.fixture(autouse=True)
+def stub_db(monkeypatch):
+    # Make DB calls no-ops for CI
+    monkeypatch.setattr(analytics, "log_event", lambda *a, **k: None)
+    monkeypatch.setattr(analytics, "_enqueue_event", lambda *a, **k: None)
+    monkeypatch.setattr(analytics, "save_user_changes", lambda *a, **k: None)
+    monkeypatch.setattr(analytics, "get_user_profile", lambda *a, **k: {})
+    monkeypatch.setattr(main, "log_event", lambda *a, **k: None)
+    monkeypatch.setattr(main, "response_cache", ResponseCache())  # no replies shared between tests
+
+
+def call(method, path, data=None):
+    """Drive the ASGI app directly; returns (status, body). `data` may be a raw body."""
+    body = data if isinstance(data, bytes) else urlencode(data or {}).encode()
+    scope = {"type": "http", "method": method, "path": path, "query_string": b""}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    return sent[0]["status"], b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def test_health():
+    assert call("GET", "/health") == (200, b"ok")
+
+
+def test_bot_requires_from_number():
+    status, body = call("POST", "/bot", {"Body": "hi"})
+    assert status == 200
+    assert b"detect your phone number" in body
+
+
+def test_body_that_is_not_utf8_is_not_an_error():
+    status, body = call("POST", "/bot", b"From=%2B20000000002&Body=caf\xe9")
+    assert status == 200
+    assert b"your name" in body
+
+
+def test_restart_without_profile_starts_over():
+    status, body = call("POST", "/bot", {"From": "+20000000000", "Body": "restart"})
+    assert status == 200
+    assert b"Let's start over" in body or b"What\xe2\x80\x99s your name?" in body
+
+
+def test_new_user_intro_prompts_for_name():
+    status, body = call("POST", "/bot", {"From": "+20000000001", "Body": "Hi"})
+    assert status == 200
+    assert b"your name" in body
+
+
+def test_gpt_reply_is_awaited(monkeypatch):
+    class FakeAsyncOpenAI:
+        def __init__(self):
+            self.chat = self.completions = self
+            self.calls = 0
+
+        async def create(self, **kwargs):
+            self.calls += 1
+            await asyncio.sleep(0)
+            message = SimpleNamespace(content=" async reply ")
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    fake = FakeAsyncOpenAI()
+    monkeypatch.setattr(asgi, "async_client", fake)
+    monkeypatch.setattr(main, "launch_guardrail_check", lambda *a, **k: None)
+
+    number = "+20000000002"
+    for body in ["Hi", "ana", "1", "1", "1"]:
+        call("POST", "/bot", {"From": number, "Body": body})
+    status, body = call("POST", "/bot", {"From": number, "Body": "He ignores my texts for days"})
+
+    assert status == 200 and b"<Body>async reply</Body>" in body
+    assert fake.calls == 1
+    assert main.STATE_STORE.get(number)[0]["current_step"] == "psychoeducation"
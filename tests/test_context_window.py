@@ -0,0 +1,115 @@
+import os
+import sys
+import asyncio
+from collections import deque
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import guardrail
+from context_window import ContextWindow, estimate_tokens
+
+
+def test_window_stays_under_budget_and_folds_old_turns():
+    window = ContextWindow(max_tokens=50, summary_tokens=100)
+    for i in range(100):
+        window.add(f"User: message number {i}")
+    text, counts = window.render()
+    assert counts["window_tokens"] <= 50
+    assert counts["summarized_turns"] + counts["window_turns"] == 100
+    assert window.turns()[-1] == "User: message number 99"
+    assert "Earlier: " in text and "nothing notable" in text
+
+
+def test_summary_keeps_salient_turns_within_budget():
+    def salience(turn):
+        return 3 if "pills" in turn else 0
+
+    window = ContextWindow(max_tokens=20, summary_tokens=30, salience=salience)
+    window.add("User: I took pills last week")
+    for i in range(50):
+        window.add(f"User: chatting about school {i}")
+    text, counts = window.render()
+    assert "I took pills last week" in text
+    assert counts["summary_tokens"] <= 30 + estimate_tokens("Earlier (50 turns), notable:\n- ")
+
+    for i in range(20):
+        window.add(f"User: more pills talk {i}")
+    _, counts = window.render()
+    assert window.summary._tokens <= 30
+
+
+def test_sync_adds_only_new_turns_of_a_sliding_history():
+    history = deque(maxlen=5)
+    window = ContextWindow(max_tokens=1000, summary_tokens=100)
+    seen = []
+    for i in range(12):
+        history.append(f"User: {i % 3}")  # repeated text on purpose
+        seen.append(window.sync(list(history)))
+    assert seen == [1] * 12
+    assert window.turns() == [f"User: {i % 3}" for i in range(12)]
+
+    # An older snapshot arriving late (priority reordering) adds nothing
+    assert window.sync(["User: 0", "User: 1"]) == 0
+
+
+def test_sync_with_a_window_smaller_than_the_history():
+    history = deque(maxlen=20)
+    window = ContextWindow(max_tokens=30, summary_tokens=100)
+    for i in range(60):
+        history.append(f"User: turn {i}")
+        assert window.sync(list(history)) == 1
+    _, counts = window.render()
+    assert counts["summarized_turns"] + counts["window_turns"] == 60
+
+
+def test_sync_starts_over_when_the_history_does():
+    history = deque(maxlen=5)
+    window = ContextWindow(max_tokens=20, summary_tokens=100)
+    for i in range(30):
+        history.append(f"User: turn {i % 4}")
+        window.sync(list(history))
+    assert window.summary.folded > 0
+
+    # A restart: the new history repeats a message the old conversation had
+    assert window.sync(["User: turn 1"]) == 1
+    assert window.turns() == ["User: turn 1"] and window.summary.folded == 0
+    assert window.sync(["User: turn 1", "User: turn 1"]) == 1
+    assert window.turns() == ["User: turn 1", "User: turn 1"]
+
+
+def test_guardrail_prompt_is_bounded_and_counted(monkeypatch):
+    prompts = []
+
+    async def classify(context, new_input):
+        prompts.append(guardrail.build_classifier_prompt(context, new_input))
+        return "SAFE"
+
+    monkeypatch.setattr(guardrail, "classify_message_async", classify)
+    monkeypatch.setattr(guardrail, "_contexts", guardrail.OrderedDict())
+    monkeypatch.setattr(
+        guardrail,
+        "_token_stats",
+        {"checks": 0, "prompt_tokens_total": 0, "prompt_tokens_max": 0, "last": {}},
+    )
+
+    history = []  # unbounded on purpose
+    for i in range(300):
+        text = "I want to die" if i == 3 else f"My friend keeps ignoring me, day {i}"
+        history.append(f"User: {text}")
+        asyncio.run(guardrail.run_guardrail_check("+1", list(history), text))
+
+    assert "[" not in prompts[-1]  # no Python repr of the history list
+    assert "I want to die" in prompts[-1]  # kept in the summary long after leaving the window
+    stats = guardrail.guardrail_token_stats()
+    assert stats["checks"] == 300
+    budget = (
+        estimate_tokens(guardrail.GUARDRAIL_SYSTEM_PROMPT)
+        + guardrail.GUARDRAIL_CONTEXT_TOKENS
+        + guardrail.GUARDRAIL_SUMMARY_TOKENS
+        + 100
+    )
+    assert stats["prompt_tokens_max"] <= budget
+    assert stats["last"]["summarized_turns"] > 0
+    assert stats["last"]["prompt_tokens"] == estimate_tokens(
+        guardrail.GUARDRAIL_SYSTEM_PROMPT
+    ) + estimate_tokens(prompts[-1])
@@ -0,0 +1,119 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import conversation_memory
+from conversation_memory import (
+    ASSISTANT,
+    USER,
+    build_messages,
+    memory_count,
+    merge_memory,
+    message_tokens,
+    remember,
+)
+from state_store import ConversationState
+
+
+def test_recent_turns_become_chat_messages():
+    state = ConversationState("gpt_mode")
+    remember(state, USER + "He ignores my texts")
+    remember(state, ASSISTANT + "That sounds lonely. How long has it been?")
+    messages = build_messages("SYSTEM", "PROMPT", state.memory)
+    assert messages == [
+        {"role": "system", "content": "SYSTEM"},
+        {"role": "user", "content": "He ignores my texts"},
+        {"role": "assistant", "content": "That sounds lonely. How long has it been?"},
+        {"role": "user", "content": "PROMPT"},
+    ]
+
+
+def test_memory_survives_the_state_record():
+    state = ConversationState("gpt_mode")
+    for i in range(30):
+        remember(state, USER + f"message {i}")
+        remember(state, ASSISTANT + f"reply {i}")
+    restored = ConversationState.from_dict(state.to_dict())
+    assert build_messages("S", "P", restored.memory) == build_messages("S", "P", state.memory)
+
+    restored.reset("choose_path")
+    assert restored.memory is None
+
+
+def test_long_conversations_keep_prompt_size_flat():
+    state = ConversationState("gpt_mode")
+    sizes = []
+    remember(state, USER + "My sister said she would hurt me if I told mom")
+    for i in range(200):
+        messages = build_messages("SYSTEM", "PROMPT", state.memory)
+        sizes.append(message_tokens(messages))
+        remember(state, USER + f"we argued again about the same thing, round {i}")
+        remember(state, ASSISTANT + f"I hear you. What felt hardest this time? ({i})")
+
+    assert max(sizes[50:]) - min(sizes[50:]) < 40  # flat once the window is full
+    last = build_messages("SYSTEM", "PROMPT", state.memory)
+    assert len(last) - 3 <= conversation_memory.MEMORY_TURNS  # system + summary + prompt
+    assert "hurt me if I told mom" in last[1]["content"]  # salient early turn kept in the summary
+
+
+def test_prompt_is_capped(monkeypatch):
+    monkeypatch.setattr(conversation_memory, "PROMPT_TOKEN_CAP", 120)
+    state = ConversationState("gpt_mode")
+    for _ in range(10):
+        remember(state, USER + "word " * 30)
+    messages = build_messages("SYSTEM", "PROMPT " * 20, state.memory)
+    assert message_tokens(messages) <= 120
+    assert messages[-1]["content"].startswith("PROMPT")
+    stats = conversation_memory.prompt_token_stats()
+    assert stats["last"]["prompt_tokens"] == message_tokens(messages)
+
+
+def test_merge_keeps_both_writers_turns():
+    state = ConversationState("gpt_mode")
+    remember(state, USER + "He ignores my texts")
+    base = state.memory
+
+    ours = ConversationState.from_dict({"memory": base})
+    remember(ours, USER + "And then acts like nothing happened")
+    theirs = ConversationState.from_dict({"memory": base})
+    remember(theirs, ASSISTANT + "That sounds painful.")
+
+    merged = merge_memory(base, ours.memory, theirs.memory)
+    assert merged["turns"] == [
+        USER + "He ignores my texts",
+        ASSISTANT + "That sounds painful.",
+        USER + "And then acts like nothing happened",
+    ]
+
+
+def test_merge_keeps_a_repeated_user_turn():
+    state = ConversationState("gpt_mode")
+    remember(state, USER + "X")
+    base = state.memory
+
+    ours = ConversationState.from_dict({"memory": base})
+    remember(ours, USER + "X")  # the user sent the same message again
+    theirs = ConversationState.from_dict({"memory": base})
+    remember(theirs, ASSISTANT + "reply", reply_to=memory_count(base))
+
+    merged = merge_memory(base, ours.memory, theirs.memory)
+    assert merged["turns"] == [USER + "X", ASSISTANT + "reply", USER + "X"]
+
+
+def test_deferred_reply_saved_first_follows_its_turn():
+    state = ConversationState("gpt_mode")
+    remember(state, USER + "He ignores my texts")
+    remember(state, ASSISTANT + "That sounds painful.")
+    base = state.memory
+
+    ours = ConversationState.from_dict({"memory": base})  # the request, not saved yet
+    remember(ours, USER + "Should I text him?")
+    theirs = ConversationState.from_dict({"memory": base})  # its deferred reply, saved first
+    remember(theirs, ASSISTANT + "What would you like to say?", reply_to=memory_count(ours.memory))
+
+    merged = merge_memory(base, ours.memory, theirs.memory)
+    assert merged["turns"][-2:] == [
+        USER + "Should I text him?",
+        ASSISTANT + "What would you like to say?",
+    ]
@@ -0,0 +1,117 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import psycopg2
+import pytest
+
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.executed.append(sql)
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        if self.broken:
+            raise psycopg2.InterfaceError("connection already closed")
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect():
+        conn = FakeConn()
+        opened.append(conn)
+        return conn
+
+    return ConnectionPool(connect, **kwargs), opened
+
+
+def test_connections_are_reused():
+    pool, opened = make_pool(maxconn=2)
+    for _ in range(5):
+        with pool.connection() as conn:
+            conn.cursor().execute("SELECT 1")
+    assert len(opened) == 1
+    assert pool.stats() == {"size": 1, "idle": 1, "in_use": 0, "max": 2}
+
+
+def test_broken_connection_is_replaced():
+    pool, opened = make_pool(maxconn=1)
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection() as conn:
+            conn.broken = True
+            conn.cursor().execute("SELECT 1")
+    assert opened[0].closed
+
+    with pool.connection() as conn:
+        assert conn is opened[1]
+    assert pool.stats()["size"] == 1
+
+
+def test_stale_connection_is_health_checked():
+    pool, opened = make_pool(maxconn=1, healthcheck_idle=0)
+    with pool.connection():
+        pass
+    opened[0].broken = True  # died while idle
+
+    with pool.connection() as conn:
+        assert conn is opened[1]
+    assert opened[0].closed
+
+
+def test_max_lifetime_recycles_connection():
+    pool, opened = make_pool(maxconn=1, max_lifetime=0)
+    with pool.connection():
+        pass
+    with pool.connection():
+        pass
+    assert len(opened) == 2
+    assert opened[0].closed
+
+
+def test_pool_times_out_when_exhausted():
+    pool, _ = make_pool(maxconn=1, timeout=0.05)
+    held = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    pool.putconn(held)
+
+
+def test_waiters_get_returned_connection():
+    pool, opened = make_pool(maxconn=1, timeout=2)
+    held = pool.getconn()
+    got = []
+    t = threading.Thread(target=lambda: got.append(pool.getconn()))
+    t.start()
+    pool.putconn(held)
+    t.join(timeout=2)
+    assert got == [held]
+    assert len(opened) == 1
@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from event_writer import EventWriter
+
+
+def test_batches_by_size_and_drains_on_stop():
+    batches = []
+    writer = EventWriter(batches.append, max_queue=100, batch_size=3, flush_interval=60)
+    for i in range(7):
+        assert writer.enqueue(("u", "evt", i))
+    writer.stop(timeout=2)
+
+    assert [len(b) for b in batches][:2] == [3, 3]
+    assert sum(len(b) for b in batches) == 7
+    stats = writer.stats()
+    assert stats["flushed"] == 7 and stats["dropped"] == 0 and stats["queued"] == 0
+
+
+def test_flushes_on_interval():
+    flushed = threading.Event()
+    writer = EventWriter(lambda rows: flushed.set(), batch_size=100, flush_interval=0.05)
+    writer.enqueue(("u", "evt", 1))
+    assert flushed.wait(timeout=2)
+    writer.stop()
+
+
+def test_full_queue_drops_without_blocking():
+    release = threading.Event()
+    writer = EventWriter(lambda rows: release.wait(2), max_queue=1, batch_size=1, flush_interval=0)
+    results = [writer.enqueue(("u", "evt", i)) for i in range(50)]
+    release.set()
+    writer.stop(timeout=2)
+
+    assert not all(results)
+    assert writer.stats()["dropped"] == results.count(False)
+
+
+def test_failed_flush_is_counted():
+    def boom(rows):
+        raise RuntimeError("db down")
+
+    writer = EventWriter(boom, batch_size=10, flush_interval=60)
+    writer.enqueue(("u", "evt", 1))
+    writer.stop(timeout=2)
+    assert writer.stats()["failed"] == 1
@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import guardrail
+from guardrail import GuardrailService
+from prescreen import prescreen
+
+
+def test_checks_run_on_one_persistent_loop_with_bounded_concurrency():
+    running, peak, loops, threads = 0, 0, set(), set()
+
+    async def check(user_id, history, user_input):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        loops.add(id(asyncio.get_running_loop()))
+        threads.add(threading.get_ident())
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    service = GuardrailService(check=check, queue_size=100, concurrency=3)
+    for i in range(20):
+        assert service.submit(f"+{i}", [], "hello")
+    assert service.stop(timeout=5)
+
+    assert peak == 3
+    assert len(loops) == 1 and len(threads) == 1
+    stats = service.stats()
+    assert stats["completed"] == 20 and stats["queue_depth"] == 0 and stats["dropped"] == 0
+
+
+def test_stop_drains_pending_checks():
+    done = []
+
+    async def check(user_id, history, user_input):
+        await asyncio.sleep(0.02)
+        done.append(user_id)
+
+    service = GuardrailService(check=check, concurrency=1)
+    for i in range(5):
+        service.submit(f"+{i}", [], "I will hurt myself tonight")
+    assert service.stop(timeout=5)
+    assert done == [f"+{i}" for i in range(5)]
+    assert not service.submit("+9", [], "late")  # no new work after stop
+
+
+def test_full_queue_drops_normal_checks_without_waiting():
+    release = threading.Event()
+
+    async def check(user_id, history, user_input):
+        await asyncio.to_thread(release.wait, 5)
+
+    service = GuardrailService(check=check, queue_size=2, concurrency=1)
+    assert service.submit("+1", [], "a")
+    assert service.submit("+2", [], "b")
+    started = time.monotonic()
+    assert not service.submit("+3", [], "c")
+    assert time.monotonic() - started < 0.05
+    assert service.stats()["dropped"] == 1
+    release.set()
+    assert service.stop(timeout=5)
+
+
+def test_risk_checks_are_never_dropped():
+    release = threading.Event()
+    done = []
+
+    async def check(user_id, history, user_input):
+        await asyncio.to_thread(release.wait, 5)
+        done.append(user_id)
+
+    service = GuardrailService(check=check, queue_size=1, concurrency=1)
+    assert service.submit("+normal", [], "a")
+    assert service.submit("+risk", [], "b", priority=guardrail.PRIORITY_RISK)
+    assert not service.submit("+late", [], "c")
+    release.set()
+    assert service.stop(timeout=5)
+    assert service.submit("+after-stop", [], "d", priority=guardrail.PRIORITY_RISK)
+
+    assert sorted(done) == ["+after-stop", "+normal", "+risk"]
+    stats = service.stats()
+    assert stats["dropped"] == 1 and stats["over_limit"] == 1 and stats["inline"] == 1
+    assert stats["completed"] == 3 and stats["queue_depth"] == 0
+
+
+def test_failed_checks_are_counted(capsys):
+    async def check(user_id, history, user_input):
+        raise RuntimeError("openai down")
+
+    service = GuardrailService(check=check)
+    service.submit("+1", [], "hi")
+    service.stop(timeout=5)
+    assert service.stats()["failed"] == 1
+
+
+def test_crisis_sends_one_notice_per_burst(monkeypatch, fake_twilio, outbound_sender):
+    async def classify(context, new_input):
+        return "CRISIS"
+
+    monkeypatch.setattr(guardrail, "classify_message_async", classify)
+    for _ in range(3):
+        assert asyncio.run(guardrail.run_guardrail_check("+1", [], "x")) == "CRISIS"
+    assert fake_twilio.sent() == [("+1", guardrail.CRISIS_MESSAGE)]
+
+
+# -------- Prescreen tier -------- #
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "guardrail_corpus.json")
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_prescreen_never_skips_crisis():
+    crisis = [item for item in load_corpus() if item["label"] == "CRISIS"]
+    tiers = {item["text"]: prescreen(item["text"]).tier for item in crisis}
+    assert [t for t, tier in tiers.items() if tier == "safe"] == []
+    # Explicit crisis phrases go to the LLM with priority
+    lexicon = [item["text"] for item in crisis if not item.get("held_out")]
+    assert [t for t in lexicon if tiers[t] != "risk"] == []
+
+
+def test_prescreen_never_skips_held_out_paraphrases():
+    # Crisis and abuse phrasings the lexicon was not written for
+    held_out = [item["text"] for item in load_corpus() if item.get("held_out")]
+    assert len(held_out) >= 10
+    assert [t for t in held_out if prescreen(t).tier == "safe"] == []
+
+
+def test_prescreen_never_skips_distress():
+    distress = [item["text"] for item in load_corpus() if item["label"] == "DISTRESS"]
+    assert [t for t in distress if prescreen(t).tier == "safe"] == []
+
+
+def test_prescreen_only_skips_acknowledgements():
+    safe = [item["text"] for item in load_corpus() if item["label"] == "SAFE"]
+    skipped = [t for t in safe if prescreen(t).tier == "safe"]
+    assert skipped == ["ok thanks", "thank you so much", "yeah that makes sense"]
+    assert prescreen("Ok!").tier == prescreen("thanks 🙏").tier == "safe"
+    assert prescreen("ok but he hits me").tier != "safe"
+
+
+def test_prescreen_considers_recent_history():
+    history = ["User: I want to die", "User: ok"]
+    assert prescreen("ok", history).tier != "safe"
+
+
+def test_risk_checks_jump_the_queue():
+    order = []
+    started, gate = threading.Event(), threading.Event()
+
+    async def check(user_id, history, user_input):
+        if user_id == "+first":
+            started.set()
+            await asyncio.to_thread(gate.wait, 5)
+        order.append(user_id)
+
+    service = GuardrailService(check=check, concurrency=1)
+    service.submit("+first", [], "x")  # occupies the single worker
+    assert started.wait(5)
+    service.submit("+normal", [], "x", priority=guardrail.PRIORITY_NORMAL)
+    service.submit("+risk", [], "x", priority=guardrail.PRIORITY_RISK)
+    gate.set()
+    assert service.stop(timeout=5)
+    assert order == ["+first", "+risk", "+normal"]
+
+
+def test_launch_skips_llm_for_safe_messages(monkeypatch):
+    submitted = []
+
+    class FakeService:
+        def submit(self, user_id, history, user_input, priority=guardrail.PRIORITY_NORMAL):
+            submitted.append((user_input, priority))
+            return True
+
+    monkeypatch.setattr(guardrail, "get_guardrail_service", lambda: FakeService())
+    monkeypatch.setattr(guardrail, "_prescreen_counts", {"risk": 0, "ambiguous": 0, "safe": 0})
+    guardrail.launch_guardrail_check("+1", [], "ok thanks")
+    guardrail.launch_guardrail_check("+1", [], "I want to die")
+    guardrail.launch_guardrail_check("+1", [], "I feel hopeless")
+
+    assert submitted == [
+        ("I want to die", guardrail.PRIORITY_RISK),
+        ("I feel hopeless", guardrail.PRIORITY_NORMAL),
+    ]
+    assert guardrail.prescreen_stats()["llm_avoided_ratio"] == 1 / 3
@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+import llm
+from llm import Route
+from metrics import Histogram
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def reply(text):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+class FakeClient:
+    """Per-model delays (seconds) or exceptions; records which models were called."""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.models = []
+        self.chat = self.completions = self
+
+    def create(self, model, messages, temperature):
+        self.models.append(model)
+        outcome = self.behaviour[model]
+        if isinstance(outcome, Exception):
+            raise outcome
+        time.sleep(outcome)
+        return reply(f"{model} reply")
+
+
+class FakeAsyncClient(FakeClient):
+    async def create(self, model, messages, temperature):
+        self.models.append(model)
+        outcome = self.behaviour[model]
+        if isinstance(outcome, Exception):
+            raise outcome
+        await asyncio.sleep(outcome)
+        return reply(f"{model} reply")
+
+
+@pytest.fixture(autouse=True)
+def routes(monkeypatch):
+    table = {
+        "validation_exploration": Route("big", 0.1, "small"),
+        "closing": Route("small", 0.1, None),
+    }
+    monkeypatch.setattr(llm, "ROUTES", table)
+    llm.llm_latency.reset()
+    slots = llm._slots
+    yield table
+    # Let hedged-away calls finish so they aren't recorded in the next test
+    for _ in range(llm.LLM_HEDGE_WORKERS):
+        slots.acquire()
+    for _ in range(llm.LLM_HEDGE_WORKERS):
+        slots.release()
+
+
+def test_every_step_has_a_route():
+    routes = llm.load_routes("")
+    assert set(routes) == set(llm._STEP_NEXT)
+    assert routes["closing"].model == llm.FAST_MODEL
+    custom = llm.load_routes('{"closing": {"model": "gpt-4", "budget": 2}}')
+    assert custom["closing"] == Route("gpt-4", 2, None)
+
+
+def test_fast_primary_is_not_hedged():
+    client = FakeClient({"big": 0.01, "small": 0.01})
+    assert llm.complete(client, "validation_exploration", MESSAGES) == "big reply"
+    assert client.models == ["big"]
+
+
+def test_slow_primary_is_hedged_to_the_fallback():
+    client = FakeClient({"big": 0.5, "small": 0.01})
+    before = llm.routing_stats()
+    started = time.monotonic()
+    assert llm.complete(client, "validation_exploration", MESSAGES) == "small reply"
+    assert time.monotonic() - started < 0.4
+    stats = llm.routing_stats()
+    assert stats["hedged"] == before["hedged"] + 1
+    assert stats["fallback_wins"] == before["fallback_wins"] + 1
+
+
+def test_failed_primary_falls_back_immediately():
+    client = FakeClient({"big": RuntimeError("overloaded"), "small": 0.01})
+    started = time.monotonic()
+    assert llm.complete(client, "validation_exploration", MESSAGES) == "small reply"
+    assert time.monotonic() - started < 0.1
+
+
+def test_all_attempts_failing_raises():
+    client = FakeClient({"big": RuntimeError("a"), "small": RuntimeError("b")})
+    with pytest.raises(RuntimeError):
+        llm.complete(client, "validation_exploration", MESSAGES)
+
+
+def test_saturated_pool_does_not_hedge(monkeypatch):
+    monkeypatch.setattr(llm, "_executor", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(llm, "_slots", threading.BoundedSemaphore(1))
+    client = FakeClient({"big": 0.3, "small": 0.01})
+    before = llm.routing_stats()["hedged"]
+    assert llm.complete(client, "validation_exploration", MESSAGES) == "big reply"
+    assert client.models == ["big"]
+    assert llm.routing_stats()["hedged"] == before
+
+
+def test_route_without_fallback_waits_for_its_model():
+    client = FakeClient({"small": 0.2})
+    assert llm.complete(client, "closing", MESSAGES) == "small reply"
+    assert client.models == ["small"]
+
+
+def test_async_hedge_cancels_the_loser():
+    client = FakeAsyncClient({"big": 5, "small": 0.01})
+    started = time.monotonic()
+    assert (
+        asyncio.run(llm.complete_async(client, "validation_exploration", MESSAGES)) == "small reply"
+    )
+    assert time.monotonic() - started < 1
+    latency = llm.routing_stats()["latency"]
+    assert latency["validation_exploration/big/cancelled"]["count"] == 1
+    assert latency["validation_exploration/small/ok"]["count"] == 1
+
+
+def test_latency_is_recorded_per_route_and_model():
+    client = FakeClient({"big": 0.01, "small": 0.01})
+    for _ in range(3):
+        llm.complete(client, "validation_exploration", MESSAGES)
+    llm.complete(client, "closing", MESSAGES)
+    latency = llm.routing_stats()["latency"]
+    assert latency["validation_exploration/big/ok"]["count"] == 3
+    assert latency["closing/small/ok"]["count"] == 1
+
+
+def test_histogram_buckets_and_percentiles():
+    h = Histogram("test_seconds", "test", labelnames=("route",), buckets=(0.1, 1, 10))
+    for value in [0.05] * 8 + [0.5, 5]:
+        h.observe(value, route="a")
+    snap = h.snapshot()[("a",)]
+    assert snap["count"] == 10 and snap["sum"] == pytest.approx(5.9)
+    assert snap["buckets"] == {0.1: 8, 1: 9, 10: 10, float("inf"): 10}
+    assert snap["p50"] == 0.1 and snap["p90"] == 1 and snap["p99"] == 10
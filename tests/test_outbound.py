@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from outbound import FAILED, SENT, SUPPRESSED, OutboundSender, TokenBucket
+
+
+def make_sender(fake_twilio, **kwargs):
+    kwargs.setdefault("backoff", 0.01)
+    return OutboundSender("ACtest", "secret", base_url=fake_twilio.url, **kwargs)
+
+
+def test_send_posts_to_the_messages_api(fake_twilio):
+    sender = make_sender(fake_twilio)
+    try:
+        assert sender.send_sync("whatsapp:+1", "hello") == SENT
+    finally:
+        sender.close()
+    path, form, auth = fake_twilio.requests[0]
+    assert path == "/2010-04-01/Accounts/ACtest/Messages.json"
+    assert form == {"To": "whatsapp:+1", "From": sender.from_number, "Body": "hello"}
+    assert auth.startswith("Basic ")
+
+
+def test_async_callers_on_another_loop(fake_twilio):
+    sender = make_sender(fake_twilio)
+
+    async def burst():
+        return await asyncio.gather(*(sender.send(f"+{i}", "hi") for i in range(20)))
+
+    try:
+        assert asyncio.run(burst()) == [SENT] * 20
+    finally:
+        sender.close()
+    assert sorted(to for to, _ in fake_twilio.sent()) == sorted(f"+{i}" for i in range(20))
+
+
+def test_cooldown_suppresses_repeats_per_user(fake_twilio):
+    sender = make_sender(fake_twilio)
+    try:
+        results = [
+            sender.send_sync("+1", "notice", dedup_key="crisis", cooldown=60) for _ in range(5)
+        ]
+        assert sender.send_sync("+2", "notice", dedup_key="crisis", cooldown=60) == SENT
+        assert sender.send_sync("+1", "other", dedup_key="other", cooldown=60) == SENT
+    finally:
+        sender.close()
+    assert results == [SENT] + [SUPPRESSED] * 4
+    assert sender.stats()["suppressed"] == 4
+    assert fake_twilio.sent() == [("+1", "notice"), ("+2", "notice"), ("+1", "other")]
+
+
+def test_transient_errors_are_retried(fake_twilio):
+    fake_twilio.statuses = [500, 429]
+    sender = make_sender(fake_twilio)
+    try:
+        assert sender.send_sync("+1", "hello") == SENT
+    finally:
+        sender.close()
+    assert len(fake_twilio.requests) == 3
+    assert sender.stats()["retried"] == 2
+
+
+def test_client_errors_fail_fast_and_release_the_cooldown(fake_twilio):
+    fake_twilio.statuses = [400]
+    sender = make_sender(fake_twilio)
+    try:
+        assert sender.send_sync("+1", "notice", dedup_key="crisis", cooldown=60) == FAILED
+        assert sender.send_sync("+1", "notice", dedup_key="crisis", cooldown=60) == SENT
+    finally:
+        sender.close()
+    assert len(fake_twilio.requests) == 2
+    assert sender.stats()["failed"] == 1
+
+
+def test_retry_after_is_capped(fake_twilio):
+    fake_twilio.statuses = [429]
+    fake_twilio.retry_after = "3600"
+    sender = make_sender(fake_twilio, max_retry_after=0.05)
+    started = time.monotonic()
+    try:
+        assert sender.send_sync("+1", "hello") == SENT
+    finally:
+        sender.close()
+    assert time.monotonic() - started < 1
+
+
+def test_send_sync_gives_up_after_its_timeout(fake_twilio):
+    fake_twilio.delay = 1
+    sender = make_sender(fake_twilio, send_timeout=0.1)
+    started = time.monotonic()
+    try:
+        assert sender.send_sync("+1", "notice", dedup_key="crisis", cooldown=60) == FAILED
+        assert time.monotonic() - started < 0.5
+        fake_twilio.delay = 0
+        # The cancelled send released its cooldown
+        assert sender.send_sync("+1", "notice", dedup_key="crisis", cooldown=60) == SENT
+    finally:
+        sender.close()
+    assert sender.stats()["failed"] == 1
+
+
+def test_token_bucket_limits_throughput():
+    async def take(n):
+        bucket = TokenBucket(rate=100, burst=5)
+        start = time.monotonic()
+        for _ in range(n):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # 5 immediate, then 20 more at 100/s
+    assert asyncio.run(take(25)) >= 0.18
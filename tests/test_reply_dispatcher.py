@@ -0,0 +1,56 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reply_dispatcher import ReplyDispatcher
+
+
+def test_replies_for_one_user_keep_order():
+    sent = []
+    dispatcher = ReplyDispatcher(lambda to, body: sent.append((to, body)), max_workers=4)
+
+    def job(body, delay):
+        def run():
+            time.sleep(delay)
+            return body
+
+        return run
+
+    # Earlier jobs are slower; a per-user chain must still deliver them first
+    for i, delay in enumerate([0.05, 0.02, 0.0]):
+        dispatcher.submit("+1", job(f"a{i}", delay))
+    dispatcher.submit("+2", job("b0", 0.0))
+    assert dispatcher.wait_idle(timeout=5)
+
+    assert [body for to, body in sent if to == "+1"] == ["a0", "a1", "a2"]
+    assert ("+2", "b0") in sent
+    dispatcher.shutdown()
+
+
+def test_users_are_served_concurrently():
+    release = threading.Event()
+    sent = []
+    dispatcher = ReplyDispatcher(lambda to, body: sent.append(to), max_workers=2)
+    dispatcher.submit("+1", lambda: release.wait(2) and "slow")
+    dispatcher.submit("+2", lambda: "fast")
+
+    deadline = time.monotonic() + 2
+    while "+2" not in sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sent == ["+2"]  # not stuck behind +1
+    release.set()
+    assert dispatcher.wait_idle(timeout=5)
+    dispatcher.shutdown()
+
+
+def test_failing_job_does_not_block_the_chain():
+    sent = []
+    dispatcher = ReplyDispatcher(lambda to, body: sent.append(body))
+    dispatcher.submit("+1", lambda: 1 / 0)
+    dispatcher.submit("+1", lambda: "after")
+    assert dispatcher.wait_idle(timeout=5)
+    assert sent == ["after"]
+    dispatcher.shutdown()
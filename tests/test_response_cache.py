@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from response_cache import ResponseCache, normalize_input, warm
+
+STEP = "validation_exploration"
+
+
+def test_normalized_inputs_share_an_entry():
+    cache = ResponseCache(steps={STEP})
+    cache.put(STEP, "scenario", "I don’t know what to do...", "reply")
+    assert normalize_input("I don’t know what to do...") == "i dont know what to do"
+    assert cache.get(STEP, "scenario ", "i  DON'T know what to do") == "reply"
+    assert cache.get(STEP, "other scenario", "i dont know what to do") is None
+
+
+def test_pool_of_variants_is_bounded():
+    cache = ResponseCache(steps={STEP}, variants=2)
+    for reply in ["a", "b", "c", "a"]:
+        cache.put(STEP, "s", "hello there", reply)
+    assert cache.pool_size(STEP, "s", "hello there") == 2
+    assert {cache.get(STEP, "s", "hello there") for _ in range(50)} == {"a", "b"}
+
+
+def test_disabled_steps_are_never_cached():
+    cache = ResponseCache(steps={STEP})
+    cache.put("psychoeducation", "s", "hello there", "reply")
+    assert cache.get("psychoeducation", "s", "hello there") is None
+    assert cache.stats()["size"] == 0 and cache.stats()["misses"] == 0
+
+
+def test_lru_and_ttl_eviction(monkeypatch):
+    cache = ResponseCache(maxsize=2, ttl=10, steps={STEP})
+    cache.put(STEP, "s", "one", "1")
+    cache.put(STEP, "s", "two", "2")
+    cache.get(STEP, "s", "one")
+    cache.put(STEP, "s", "three", "3")  # evicts "two", the least recently used
+    assert cache.get(STEP, "s", "two") is None
+    assert cache.get(STEP, "s", "one") == "1"
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get(STEP, "s", "one") is None
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2 and stats["misses"] == 2
+    assert stats["steps"][STEP]["hit_rate"] == 0.5
+
+
+def test_warm_up_saves_and_loads(tmp_path):
+    calls = []
+
+    def complete(prompt):
+        calls.append(prompt)
+        return f"reply {len(calls)}"
+
+    cache = ResponseCache(steps={STEP}, variants=2)
+    made = warm(
+        cache, ["s1", "s2"], complete, openers=["that's me", "it hurts so much"], variants=2
+    )
+    assert made == 8 and "Situation: s1" in calls[0]
+
+    path = str(tmp_path / "cache.json")
+    assert cache.save(path) == 4
+    loaded = ResponseCache(steps={STEP})
+    assert loaded.load(path) == 4
+    assert loaded.get(STEP, "s2", "It hurts so much!") in {"reply 7", "reply 8"}
+    assert ResponseCache(steps=set()).load(path) == 0
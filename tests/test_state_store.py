@@ -0,0 +1,108 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+
+from state_store import (
+    STATE_HISTORY_MAX,
+    ConversationState,
+    MemoryStateStore,
+    SQLiteStateStore,
+    StateConflict,
+    decode_record,
+    encode_record,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStateStore()
+    return SQLiteStateStore(str(tmp_path / "state.db"))
+
+
+def test_roundtrip_and_versioning(store):
+    assert store.get("+1") == (None, 0)
+    v1 = store.put("+1", {"state": {"stage": "intro"}, "session": None}, 0)
+    assert v1 == 1
+    record, version = store.get("+1")
+    assert record["state"]["stage"] == "intro" and version == 1
+
+    record["state"]["stage"] = "choose_path"
+    assert store.put("+1", record, version) == 2
+
+
+def test_stale_write_is_rejected(store):
+    store.put("+1", {"state": {"stage": "intro"}}, 0)
+    store.put("+1", {"state": {"stage": "choose_path"}}, 1)
+    with pytest.raises(StateConflict):
+        store.put("+1", {"state": {"stage": "assessment"}}, 1)
+    with pytest.raises(StateConflict):
+        store.put("+1", {"state": {}}, 0)  # concurrent first write
+    assert store.get("+1")[0]["state"]["stage"] == "choose_path"
+
+
+def test_batched_reads_and_atomic_writes(store):
+    store.put_many({"+1": ({"n": 1}, 0), "+2": ({"n": 2}, 0)})
+    assert {uid: r["n"] for uid, (r, _) in store.get_many(["+1", "+2", "+3"]).items()} == {
+        "+1": 1,
+        "+2": 2,
+    }
+    with pytest.raises(StateConflict) as exc:
+        store.put_many({"+1": ({"n": 10}, 1), "+2": ({"n": 20}, 0)})
+    assert exc.value.user_ids == ["+2"]
+    assert store.get("+1")[0]["n"] == 1  # nothing written
+
+
+def test_sqlite_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "state.db")
+    worker_a, worker_b = SQLiteStateStore(path), SQLiteStateStore(path)
+    worker_a.put("+1", {"state": {"stage": "gpt_mode"}}, 0)
+    assert worker_b.get("+1") == ({"state": {"stage": "gpt_mode"}}, 1)
+
+
+def test_large_records_are_compressed():
+    record = {"history": ["User: " + "so much to say " * 20] * 20}
+    blob = encode_record(record)
+    assert blob[:1] == b"z" and len(blob) < len(str(record))
+    assert decode_record(blob) == record
+
+
+def test_memory_store_evicts_lru_and_idle():
+    store = MemoryStateStore(max_entries=2, idle_ttl=3600)
+    store.put("+1", {"stage": "intro"}, 0)
+    store.put("+2", {"stage": "intro"}, 0)
+    store.get("+1")
+    store.put("+3", {"stage": "intro"}, 0)  # evicts +2, the least recently used
+    assert store.get("+2") == (None, 0)
+    assert store.stats()["sessions"] == 2
+
+    assert store.purge_idle(max_idle=0) == 2
+    assert store.stats() == {"sessions": 0, "bytes": 0, "evicted": 3}
+
+
+def test_memory_store_tracks_resident_bytes():
+    store = MemoryStateStore()
+    store.put("+1", {"stage": "intro"}, 0)
+    size = store.stats()["bytes"]
+    store.put("+1", {"stage": "choose_path", "category": "Family Tensions"}, 1)
+    assert store.stats()["bytes"] > size
+    store.delete("+1")
+    assert store.stats()["bytes"] == 0
+
+
+def test_conversation_state_is_compact_and_bounded():
+    state = ConversationState("gpt_mode")
+    for i in range(STATE_HISTORY_MAX + 5):
+        state.history.append(f"User: message {i}")
+    assert len(state.history) == STATE_HISTORY_MAX
+    assert not hasattr(state, "__dict__")
+
+    data = state.to_dict()
+    assert set(data) == {"stage", "history"}  # unset fields are omitted
+    restored = ConversationState.from_dict(data)
+    assert restored.stage == "gpt_mode"
+    assert list(restored.history) == list(state.history)
+    assert restored.history.maxlen == STATE_HISTORY_MAX